@@ -1,21 +1,49 @@
-from phi.agent import Agent
-from phi.tools.sql import SQLTools
-from phi.model.google import Gemini
 from dotenv import load_dotenv
 import os
+import threading
+from tracing import traced_agent_call, record_tokens
 
 
 load_dotenv()
 
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
+
+def build_agent(model_id=None, generation_config=None, **kwargs):
+    """
+    Build a Gemini-backed phi Agent.
+
+    phi and the Google SDK are imported here rather than at module level so that
+    importing this module stays cheap; the cost is paid by the first agent built.
+
+    Parameters:
+    model_id (str): Gemini model name; None keeps phi's default Gemini model, which
+                    is what every agent has always run on.
+    generation_config (dict): Optional temperature / max_output_tokens etc.
+    """
+    from phi.agent import Agent
+    from phi.model.google import Gemini
+
+    if not os.getenv("GOOGLE_API_KEY"):
+        raise RuntimeError("GOOGLE_API_KEY is not set")
+    model = Gemini(id=model_id, generation_config=generation_config) if model_id else Gemini(generation_config=generation_config)
+    return Agent(model=model, **kwargs)
+
+
+def report_usage(response):
+    """Pass the token counts of a phi RunResponse on to tracing.record_tokens"""
+    metrics = getattr(response, "metrics", None) or {}
+
+    def total(name):
+        value = metrics.get(name, 0)
+        return sum(value) if isinstance(value, list) else (value or 0)
+
+    record_tokens(total("input_tokens"), total("output_tokens"))
 
 class SQLAgent:
     def __init__(self):
         """
         Initializes an SQLAgent to generate SQL queries to check if a user exists in the database.
         """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+        self.agent = build_agent(
             description="This agent generates SQL queries to check if a user exists in the database.",
             instructions=[
                 """
@@ -37,6 +65,7 @@ class SQLAgent:
             ]
         )
     
+    @traced_agent_call
     def generate_query(self, phone_number: str) -> str:
         """
         Generates an SQL query to check if a user exists in the database.
@@ -64,8 +93,7 @@ class ChatAgent:
         """
         Initializes a ChatAgent to manage chat sessions and generate queries related to chat functionality.
         """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+        self.agent = build_agent(
             description="This agent manages chat sessions and generates queries related to chat functionality.",
             instructions=[
                 """
@@ -96,6 +124,7 @@ class ChatAgent:
             ]
         )
     
+    @traced_agent_call
     def check_active_chat(self, user_id: str) -> str:
         """
         Generates an SQL query to check if a user has an active chat.
@@ -120,6 +149,7 @@ class ChatAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def create_new_chat(self, user_id: str) -> str:
         """
         Generates an SQL query to create a new active chat for a user.
@@ -142,6 +172,7 @@ class ChatAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def get_chat_messages(self, chat_id: str) -> str:
         """
         Generates an SQL query to retrieve all messages for a specific chat.
@@ -165,6 +196,7 @@ class ChatAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
 
+    @traced_agent_call
     def save_message(self, chat_id: str, user_id: str, user_message: str, bot_reply: str) -> str:
         """
         Generates an SQL query to save a message exchange.
@@ -190,6 +222,7 @@ class ChatAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
 
+    @traced_agent_call
     def end_chat(self, chat_id: str) -> str:
         """
         Generates an SQL query to end a chat session.
@@ -218,8 +251,7 @@ class DataAgent:
         """
         Initializes a DataAgent to generate queries for retrieving products, artists, and appointments.
         """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+        self.agent = build_agent(
             description="This agent generates queries for retrieving products, artists, and appointments.",
             instructions=[
                 """
@@ -256,6 +288,7 @@ class DataAgent:
             ]
         )
     
+    @traced_agent_call
     def get_all_products(self) -> str:
         """
         Generates an SQL query to retrieve all products.
@@ -275,6 +308,7 @@ class DataAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def get_all_artists(self) -> str:
         """
         Generates an SQL query to retrieve all artists.
@@ -294,6 +328,7 @@ class DataAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def get_all_appointments(self) -> str:
         """
         Generates an SQL query to retrieve all appointments for today.
@@ -315,6 +350,7 @@ class DataAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def create_appointment(self, user_id: str, artist_id: str, product_id: str, booking_time: str) -> str:
         """
         Generates an SQL query to create a new appointment.
@@ -341,12 +377,19 @@ class DataAgent:
         return response.content
 
 class BookingAgent:
-    def __init__(self):
+    def __init__(self, profile=None):
         """
         Initializes a BookingAgent to handle the conversation flow for booking appointments.
-        """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+
+        Parameters:
+        profile (ModelProfile): Optional model tier (see model_router.py); the default model otherwise.
+        """
+        model_kwargs = {}
+        if profile is not None:
+            # a profile without a model keeps the default, like the other agents
+            model_kwargs = {"model_id": profile.model, "generation_config": profile.generation_config()}
+        self.agent = build_agent(
+            **model_kwargs,
             description="This agent handles the conversation flow for booking appointments at a beauty and wellness spa.",
             instructions=[
                 """
@@ -379,7 +422,8 @@ class BookingAgent:
             ]
         )
     
-    def process_message(self, user_message: str, user_data: dict, chat_history: list, products: list, artists: list, appointments: list) -> str:
+    @traced_agent_call
+    def process_message(self, user_message: str, user_data: dict, chat_history: list, products: list, artists: list, appointments: list, persona: str = None, hints: str = None) -> str:
         """
         Process a user message and generate a response.
         
@@ -390,13 +434,37 @@ class BookingAgent:
         products (list): The list of products.
         artists (list): The list of artists.
         appointments (list): The list of appointments.
+        persona (str): Optional spa-specific persona that overrides the default BeautyBot voice.
+        hints (str): Optional service/artist matches resolved locally from the message.
         
         Returns:
         str: The agent's response.
         """
-        prompt = f"""
+        prompt = self.build_prompt(user_message, user_data, chat_history, products, artists, appointments, persona, hints)
+        response = self.agent.run(prompt, markdown=True)
+        report_usage(response)
+        return response.content
+
+    @traced_agent_call
+    def stream_message(self, user_message: str, user_data: dict, chat_history: list, products: list, artists: list, appointments: list, persona: str = None, hints: str = None):
+        """
+        Same as process_message, but yields the response text piece by piece as the model streams it.
+
+        Returns:
+        Iterator[str]: Response text deltas.
+        """
+        prompt = self.build_prompt(user_message, user_data, chat_history, products, artists, appointments, persona, hints)
+        for chunk in self.agent.run(prompt, stream=True, markdown=True):
+            content = getattr(chunk, "content", chunk)
+            if isinstance(content, str) and content:
+                yield content
+
+    def build_prompt(self, user_message, user_data, chat_history, products, artists, appointments, persona=None, hints=None):
+        persona_note = f"\n        Persona for this spa: {persona}\n" if persona else ""
+        hints_note = f"\n        Hint: {hints}\n" if hints else ""
+        prompt = f"""{persona_note}
         User: {user_message}
-        
+        {hints_note}
         User Data: {user_data}
         
         Chat History:
@@ -419,16 +487,14 @@ class BookingAgent:
         - Otherwise, provide a helpful response to guide the booking process
         """
         
-        response = self.agent.run(prompt, markdown=True)
-        return response.content
+        return prompt
 
 class FormattingAgent:
     def __init__(self):
         """
         Initializes a FormattingAgent to format JSON data into a more concise, presentable form.
         """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+        self.agent = build_agent(
             description="This agent formats JSON data into a more concise, presentable form.",
             instructions=[
                 """
@@ -457,6 +523,7 @@ class FormattingAgent:
             ]
         )
     
+    @traced_agent_call
     def format_products(self, products_data: list) -> str:
         """
         Format products data into a more concise, presentable form.
@@ -478,6 +545,7 @@ class FormattingAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def format_artists(self, artists_data: list) -> str:
         """
         Format artists data into a more concise, presentable form.
@@ -499,6 +567,7 @@ class FormattingAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
     
+    @traced_agent_call
     def format_appointments(self, appointments_data: list) -> str:
         """
         Format appointments data into a more concise, presentable form.
@@ -520,8 +589,42 @@ class FormattingAgent:
         response = self.agent.run(query_prompt, markdown=True)
         return response.content
 
-sql_agent = SQLAgent()
-chat_agent = ChatAgent()
-data_agent = DataAgent()
-booking_agent = BookingAgent()
-formatting_agent = FormattingAgent()
\ No newline at end of file
+class LazyAgent:
+    """
+    Stands in for an agent instance and constructs it on first use, so importing
+    this module (and every uvicorn worker that does) doesn't build five models up front.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    @property
+    def is_built(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        state = "built" if self.is_built else "not built"
+        return f"<LazyAgent {self._factory.__name__} ({state})>"
+
+sql_agent = LazyAgent(SQLAgent)
+chat_agent = LazyAgent(ChatAgent)
+data_agent = LazyAgent(DataAgent)
+booking_agent = LazyAgent(BookingAgent)
+formatting_agent = LazyAgent(FormattingAgent)
+
+def warm_up():
+    """Construct every agent now instead of on the first request (the booking agent's tiers: model_router.warm_up)"""
+    for agent in (sql_agent, chat_agent, data_agent, formatting_agent):
+        agent.get()
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+Booking analytics from incrementally maintained rollups.
+
+`booking_rollups` holds one row per (day, artist, service) with the number of
+live (not cancelled), completed and cancelled appointments. Triggers created
+by init_db update the matching cell in the same transaction as every booking,
+status change, reschedule or delete, so reports read a few hundred rollup
+rows instead of aggregating `appointments` while the webhook is writing to it.
+Revenue and booked minutes are live bookings times the current
+`products.price` / `duration`, joined in at read time, so they always match
+an aggregate over `appointments` even after a price change.
+
+`rebuild_rollups` recomputes the table from history in one streaming pass
+(used for backfills, after bulk imports and on the first start of an existing
+database).
+
+Usage:
+    python analytics.py backfill
+    python analytics.py show --group artist,day --start 2025-03-01 --end 2025-03-31
+    python analytics.py check
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import database
+
+ANALYTICS_MAX_AGE_SECONDS = int(os.getenv("ANALYTICS_MAX_AGE_SECONDS", "30"))
+
+# group name -> (columns selected, columns grouped on)
+GROUPS = {
+    "day": (["r.day AS day"], ["r.day"]),
+    "artist": (["r.artist_id AS artist_id", "a.name AS artist"], ["r.artist_id"]),
+    "service": (["r.product_id AS product_id", "p.name AS service"], ["r.product_id"]),
+}
+SOURCE_TABLES = ("booking_rollups", "products", "artists")
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def rebuild_rollups(conn, fetch_size=5000):
+    """
+    Recompute booking_rollups from every appointment in one pass.
+
+    Runs under the write lock (BEGIN IMMEDIATE unless `conn` is already in a
+    transaction) so no booking can land between the scan and the swap.
+    Memory grows with the number of (day, artist, service) cells, not with
+    the number of appointments.
+
+    Returns:
+    dict: Appointments scanned, cells written, elapsed seconds and rows per second.
+    """
+    start = time.perf_counter()
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        cells = {}
+        count = 0
+        cursor = conn.execute(
+            "SELECT COALESCE(date(booking_time), 'unknown'), artist_id, product_id, lower(status) FROM appointments"
+        )
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                break
+            for day, artist_id, product_id, status in batch:
+                cell = cells.get((day, artist_id, product_id))
+                if cell is None:
+                    cell = cells[(day, artist_id, product_id)] = [0, 0, 0]
+                cell[0] += status != "cancelled"
+                cell[1] += status == "completed"
+                cell[2] += status == "cancelled"
+            count += len(batch)
+        conn.execute("DELETE FROM booking_rollups")
+        conn.executemany(
+            "INSERT INTO booking_rollups (day, artist_id, product_id, bookings, completed, cancelled) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key + tuple(cell) for key, cell in cells.items()),
+        )
+        if own_transaction:
+            conn.commit()
+    except Exception:
+        if own_transaction:
+            conn.rollback()
+        raise
+    elapsed = time.perf_counter() - start
+    return {
+        "appointments": count,
+        "cells": len(cells),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(count / elapsed, 1) if elapsed else None,
+    }
+
+
+def parse_group(group):
+    """'artist,day' -> ["artist", "day"]; raises ValueError for unknown names"""
+    names = [name.strip() for name in (group or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in GROUPS]
+    if unknown:
+        raise ValueError(f"unknown group {', '.join(unknown)} (choose from {', '.join(GROUPS)})")
+    return list(dict.fromkeys(names))
+
+
+def _check_date(value, name):
+    if value is not None and not _DATE.match(value):
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+
+def booking_summary(group="artist", start=None, end=None):
+    """
+    Bookings, cancellations, revenue and booked minutes, grouped.
+
+    Parameters:
+    group (str): Comma separated subset of day, artist, service; empty for one overall row.
+    start (str): First day included (YYYY-MM-DD), optional.
+    end (str): Last day included (YYYY-MM-DD), optional.
+
+    Returns:
+    dict: The grouping, the date range, one row per group and overall totals.
+    """
+    names = parse_group(group)
+    _check_date(start, "start")
+    _check_date(end, "end")
+    selected = [column for name in names for column in GROUPS[name][0]]
+    grouped = [column for name in names for column in GROUPS[name][1]]
+    conditions, params = [], []
+    if start or end:
+        # both bounds, so the 'unknown' day of unparseable booking times stays out of ranges
+        conditions.append("r.day BETWEEN ? AND ?")
+        params.extend([start or "0000-01-01", end or "9999-12-31"])
+    query = f"""
+        SELECT {', '.join(selected + [''])}
+            SUM(r.bookings) AS bookings,
+            SUM(r.completed) AS completed,
+            SUM(r.cancelled) AS cancelled,
+            ROUND(SUM(r.bookings * COALESCE(p.price, 0)), 2) AS revenue,
+            SUM(r.bookings * COALESCE(p.duration, 0)) AS booked_minutes
+        FROM booking_rollups r
+        LEFT JOIN products p ON p.id = r.product_id
+        LEFT JOIN artists a ON a.id = r.artist_id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        {'GROUP BY ' + ', '.join(grouped) if grouped else ''}
+        {'HAVING SUM(r.bookings) + SUM(r.cancelled) > 0 ORDER BY ' + ', '.join(grouped) if grouped else ''}
+    """
+    rows = database.execute_query(query, params)
+    if rows is False:
+        raise RuntimeError("booking rollup query failed")
+    totals = {
+        key: sum(row[key] or 0 for row in rows)
+        for key in ("bookings", "completed", "cancelled", "revenue", "booked_minutes")
+    }
+    totals["revenue"] = round(totals["revenue"], 2)
+    return {"group": names, "start": start, "end": end, "rows": rows, "totals": totals}
+
+
+def summary_etag(group, start, end):
+    """ETag for a summary: changes whenever a rollup, product or artist row is written"""
+    versions = database.current_versions()
+    state = [
+        database.current_db_file(),
+        group, start, end,
+        [versions.get(table, 0) for table in SOURCE_TABLES],
+    ]
+    return '"' + hashlib.sha1(json.dumps(state).encode()).hexdigest()[:20] + '"'
+
+
+def check_rollups(conn):
+    """Cells where booking_rollups disagrees with an aggregate over appointments"""
+    conn.row_factory = sqlite3.Row
+    expected = {
+        (row["day"], row["artist_id"], row["product_id"]): (row["bookings"], row["completed"], row["cancelled"])
+        for row in conn.execute("""
+            SELECT COALESCE(date(booking_time), 'unknown') AS day, artist_id, product_id,
+                SUM(lower(status) IS NOT 'cancelled') AS bookings,
+                SUM(lower(status) IS 'completed') AS completed,
+                SUM(lower(status) IS 'cancelled') AS cancelled
+            FROM appointments GROUP BY 1, 2, 3
+        """)
+    }
+    actual = {
+        (row["day"], row["artist_id"], row["product_id"]): (row["bookings"], row["completed"], row["cancelled"])
+        for row in conn.execute("SELECT * FROM booking_rollups WHERE bookings OR completed OR cancelled")
+    }
+    return [
+        {"day": key[0], "artist_id": key[1], "product_id": key[2],
+         "expected": expected.get(key, (0, 0, 0)), "actual": actual.get(key, (0, 0, 0))}
+        for key in sorted(set(expected) | set(actual), key=str)
+        if expected.get(key, (0, 0, 0)) != actual.get(key, (0, 0, 0))
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Booking analytics rollups")
+    parser.add_argument("--db", help="Database file (defaults to DB_FILE / spa_booking.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("backfill", help="Rebuild booking_rollups from all appointments")
+    backfill.add_argument("--fetch-size", type=int, default=5000)
+
+    show = commands.add_parser("show", help="Print a summary as JSON")
+    show.add_argument("--group", default="artist", help="Comma separated: day, artist, service")
+    show.add_argument("--start")
+    show.add_argument("--end")
+
+    commands.add_parser("check", help="Compare the rollups with a full aggregate of appointments")
+
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DB_FILE = args.db
+    database.init_db()
+
+    if args.command == "show":
+        print(json.dumps(booking_summary(args.group, args.start, args.end), indent=2))
+        return 0
+    conn = sqlite3.connect(database.DB_FILE, timeout=30)
+    try:
+        if args.command == "backfill":
+            print(json.dumps(rebuild_rollups(conn, args.fetch_size)), file=sys.stderr)
+            return 0
+        mismatches = check_rollups(conn)
+    finally:
+        conn.close()
+    print(json.dumps({"mismatched_cells": len(mismatches), "sample": mismatches[:10]}, indent=2))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
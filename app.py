@@ -1,26 +1,54 @@
 from fastapi import FastAPI, Request, Response, Form
-from twilio.rest import Client
+from fastapi.responses import PlainTextResponse, JSONResponse
 from twilio.request_validator import RequestValidator
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import os
 import logging
 from typing import Optional
-import json
-import requests
-from Agents import sql_agent, chat_agent, data_agent, booking_agent, formatting_agent
-from database import execute_query, init_db
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+from Agents import sql_agent, chat_agent, data_agent, formatting_agent, warm_up
+from model_router import booking_router
+from database import execute_query, init_db, query_cache
+from tracing import span, message_trace, render_metrics, mark_reply_sent, message_elapsed
+from profiler import request_profiler
+from log_config import setup_logging, set_level, get_levels, mask_phone
+from reminders import reminder_scheduler, REMINDERS_ENABLED
+from tenants import tenant_manager, current_tenant
+from matcher import selection_hints
+from webhook_security import VALIDATE_SIGNATURES, replay_cache, precheck, public_url, reject
+from progressive import STREAM_REPLIES, ACK_MESSAGE, should_acknowledge, stream_reply, predictor
+from analytics import ANALYTICS_MAX_AGE_SECONDS, booking_summary, summary_etag
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
 load_dotenv()
 
 
-app = FastAPI()
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the database and, if WARMUP_ON_STARTUP is set, build agents and clients before serving"""
+    init_db()
+    request_profiler.install_signal_handler()
+    if WARMUP_ON_STARTUP:
+        logger.info("Warming up agents and Twilio client")
+        warm_up()
+        booking_router.warm_up()
+        get_twilio_client()
+        get_validator()
+    if REMINDERS_ENABLED:
+        reminder_scheduler.start(twilio_send)
+    yield
+    if reminder_scheduler.running:
+        reminder_scheduler.stop()
+    tenant_manager.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -29,28 +57,43 @@ TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 TWILIO_WHATSAPP_NUMBER = "whatsapp:+14155238886"
 
 
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-validator = RequestValidator(TWILIO_AUTH_TOKEN)
+twilio_client = None
+validator = None
+
+
+def get_twilio_client():
+    """Twilio REST client, created on first use"""
+    global twilio_client
+    if twilio_client is None:
+        from twilio.rest import Client
+        twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    return twilio_client
+
+def get_validator():
+    """Twilio signature validator, created on first use"""
+    global validator
+    if validator is None:
+        validator = RequestValidator(TWILIO_AUTH_TOKEN)
+    return validator
 
 
 MOCK_MODE = False  
 
 
-async def verify_twilio_request(request: Request) -> bool:
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+
+def verify_twilio_request(request: Request, form_data, signature: str, request_validator) -> bool:
+    """Check the X-Twilio-Signature HMAC over the public URL and the already parsed form"""
     try:
-        url = str(request.url)
-        form_data = await request.form()
-        signature = request.headers.get("X-Twilio-Signature", "")
-        
-        logger.debug(f"Validating request - URL: {url}")
-        logger.debug(f"Form data: {form_data}")
-        logger.debug(f"Twilio signature: {signature}")
-        
-        is_valid = validator.validate(url, form_data, signature)
-        logger.debug(f"Request validation result: {is_valid}")
+        url = public_url(request)
+        logger.debug("Validating request - URL: %s", url)
+        is_valid = request_validator.validate(url, form_data, signature)
+        logger.debug("Request validation result: %s", is_valid)
         return is_valid
     except Exception as e:
-        logger.error(f"Error validating request: {e}", exc_info=True)
+        logger.error("Error validating request: %s", e, exc_info=True)
         return False
 
 @app.get("/")
@@ -58,15 +101,108 @@ async def root():
     logger.info("Root endpoint hit")
     return {"message": "Beauty Spa Booking System is running"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint for stage, agent and database timings"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def is_admin(request: Request) -> bool:
+    """Admin endpoints require the X-Admin-Token header to match ADMIN_TOKEN"""
+    return bool(ADMIN_TOKEN) and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+@app.get("/admin/profiling")
+async def profiling_status(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return request_profiler.status()
+
+@app.post("/admin/profiling")
+async def configure_profiling(request: Request, enabled: bool = True, sample_rate: Optional[float] = None):
+    """Switch sampled request profiling on or off at runtime"""
+    if not is_admin(request):
+        return Response(status_code=403)
+    if enabled:
+        request_profiler.enable(sample_rate)
+    else:
+        request_profiler.disable()
+    return request_profiler.status()
+
+@app.get("/admin/tenants")
+async def tenant_stats(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return tenant_manager.stats()
+
+@app.get("/admin/query-cache")
+async def query_cache_stats(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return query_cache.stats()
+
+@app.get("/admin/model-tiers")
+async def model_tier_stats(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return booking_router.stats()
+
+@app.get("/admin/latency")
+async def latency_estimates(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return {"stages": predictor.estimates(), "streaming": STREAM_REPLIES}
+
+@app.get("/admin/analytics/bookings")
+def booking_analytics(request: Request, group: str = "artist", start: Optional[str] = None,
+                      end: Optional[str] = None, tenant: Optional[str] = None):
+    """Bookings, cancellations and revenue per artist/service/day, read from the booking rollups"""
+    if not is_admin(request):
+        return Response(status_code=403)
+    headers = {"Cache-Control": f"private, max-age={ANALYTICS_MAX_AGE_SECONDS}"}
+    selected = None
+    if tenant:
+        selected = tenant_manager.get(tenant)
+        if selected is None:
+            return Response(status_code=404)
+    with tenant_manager.activate(selected):
+        headers["ETag"] = summary_etag(group, start, end)
+        if request.headers.get("If-None-Match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        try:
+            summary = booking_summary(group, start, end)
+        except ValueError as e:
+            return Response(content=str(e), status_code=400)
+    return JSONResponse(summary, headers=headers)
+
+@app.get("/admin/logging")
+async def logging_levels(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return get_levels()
+
+@app.post("/admin/logging")
+async def change_logging_level(request: Request, logger_name: str = "root", level: str = "INFO"):
+    """Change one module's log level at runtime, e.g. ?logger_name=database&level=DEBUG"""
+    if not is_admin(request):
+        return Response(status_code=403)
+    try:
+        set_level(logger_name, level)
+    except (ValueError, TypeError) as e:
+        return Response(content=str(e), status_code=400)
+    return get_levels()
+
+@app.post("/admin/profiling/flush")
+async def flush_profiling(request: Request):
+    if not is_admin(request):
+        return Response(status_code=403)
+    return {"path": request_profiler.flush()}
 
-init_db()
 
 def query_database(query: str):
     """
     Execute query against the SQLite database
     """
     try:
-        logger.debug(f"Executing query: {query}")
+        logger.debug("Executing query: %s", query)
         
         
         clean_query = query.strip()
@@ -81,66 +217,132 @@ def query_database(query: str):
         clean_query = clean_query.replace("NOW()", "CURRENT_TIMESTAMP")
         clean_query = clean_query.replace("CURDATE()", "DATE('now')")
         
-        logger.debug(f"Cleaned query: {clean_query}")
+        logger.debug("Cleaned query: %s", clean_query)
+
+        # a booking cancelled, moved or deleted by agent SQL must not keep its old
+        # reminder (the scheduler only covers the default database)
+        changed_appointments = None
+        if reminder_scheduler.running and current_tenant() is None:
+            changed_appointments = reminder_scheduler.changed_by(clean_query)
         
         result = execute_query(clean_query)
-        logger.debug(f"Query result: {result}")
+        if changed_appointments:
+            reminder_scheduler.sync(changed_appointments)
+        logger.debug("Query result: %s", result)
         
         return result
     except Exception as e:
-        logger.error(f"Error executing query: {e}")
+        logger.error("Error executing query: %s", e)
         return False
 
 def send_whatsapp_message(body, to_number):
     """Send WhatsApp message with mock mode support"""
     try:
         if MOCK_MODE:
-            logger.info(f"MOCK MODE: Would send message to {to_number}: {body}")
+            logger.info("MOCK MODE: Would send a %s character message to %s", len(body), mask_phone(to_number))
+            logger.debug("MOCK MODE message body: %s", body)
             return {"sid": "MOCK_SID_" + str(hash(body))[:8]}
         else:
-            response = twilio_client.messages.create(
+            response = get_twilio_client().messages.create(
                 from_=TWILIO_WHATSAPP_NUMBER,
                 body=body,
                 to=to_number
             )
             return response
     except Exception as e:
-        logger.error(f"Error sending message: {e}")
+        logger.error("Error sending message: %s", e)
         return {"sid": "ERROR_SID", "error": str(e)}
 
+def twilio_send(body, to_number):
+    """Send a WhatsApp reply through Twilio (the current tenant's account, if any), timed as the twilio_send stage"""
+    tenant = current_tenant()
+    with span("twilio_send"):
+        if tenant is not None:
+            response = tenant.twilio_client().messages.create(
+                from_=tenant.config.whatsapp_number,
+                body=body,
+                to=to_number
+            )
+        else:
+            response = get_twilio_client().messages.create(
+                from_=TWILIO_WHATSAPP_NUMBER,
+                body=body,
+                to=to_number
+            )
+    mark_reply_sent()
+    return response
+
 @app.post("/webhook/whatsapp")
 async def whatsapp_webhook(request: Request):
     """
     Webhook endpoint for WhatsApp messages - Beauty Spa Booking System
     """
     print('Webhook hit')
-    try:
+    # reject forged or replayed requests before any agent, database or Twilio work
+    signature = None
+    if VALIDATE_SIGNATURES:
+        signature = precheck(request, replay_cache)
+        if signature is None:
+            return Response(status_code=403)
+    with span("parse_form"):
         form_data = await request.form()
+    tenant_config = None
+    if tenant_manager.enabled:
+        tenant_config = tenant_manager.config_for(form_data.get("To", ""))
+        if tenant_config is None:
+            reject("unknown_tenant")
+            logger.warning("No tenant registered for number %s", form_data.get("To", ""))
+            return Response(
+                content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
+                media_type="application/xml"
+            )
+    if VALIDATE_SIGNATURES:
+        # tenants without their own credentials are signed with the default account's token
+        if tenant_config is not None and tenant_config.twilio_auth_token:
+            request_validator = tenant_config.validator()
+        else:
+            request_validator = get_validator()
+        if not verify_twilio_request(request, form_data, signature, request_validator):
+            reject("invalid_signature")
+            logger.warning("Rejected webhook with an invalid Twilio signature from %s", request.client.host if request.client else "unknown")
+            return Response(status_code=403)
+        if not replay_cache.add(signature):
+            reject("replay")
+            return Response(status_code=403)
+    tenant = tenant_manager.get(form_data.get("To", "")) if tenant_config is not None else None
+    with message_trace():
+        with tenant_manager.activate(tenant):
+            if request_profiler.should_profile(request):
+                with request_profiler.profile():
+                    return await _handle_whatsapp_webhook(form_data)
+            return await _handle_whatsapp_webhook(form_data)
+
+async def _handle_whatsapp_webhook(form_data):
+    try:
         form_dict = dict(form_data)
-        logger.debug(f"Received WhatsApp webhook data: {form_dict}")
+        logger.debug("Received WhatsApp webhook data: %s", form_dict)
 
         from_number = form_dict.get("From", "")
         body = form_dict.get("Body", "")
         wa_id = form_dict.get("WaId", "")
         
-        logger.info(f"WhatsApp message received - From: {from_number}, Body: {body}, WaId: {wa_id}")
+        # numbers and message text are personal data: masked at INFO, in full only at DEBUG
+        logger.info("WhatsApp message received - From: %s, %s characters", mask_phone(from_number), len(body))
+        logger.debug("WhatsApp message - From: %s, Body: %s, WaId: %s", from_number, body, wa_id)
         
         if wa_id:
             try:
                 clean_number = from_number.replace("whatsapp:", "")
                 
-                sql_query = sql_agent.generate_query(clean_number)
-                logger.info(f"Generated SQL query for user check: {sql_query}")
+                with span("identity_lookup"):
+                    sql_query = sql_agent.generate_query(clean_number)
+                    logger.debug("Generated SQL query for user check: %s", sql_query)
                 
-                user_result = query_database(sql_query)
+                    user_result = query_database(sql_query)
                 
                 if not user_result or not user_result[0].get("is_member"):
-                    response = twilio_client.messages.create(
-                        from_=TWILIO_WHATSAPP_NUMBER,
-                        body="You are not subscribed to our membership. Please contact zainxaidi2003@gmail.com for membership details.",
-                        to=from_number
-                    )
-                    logger.info(f"Non-member message sent with SID: {response.sid}")
+                    response = twilio_send("You are not subscribed to our membership. Please contact zainxaidi2003@gmail.com for membership details.", from_number)
+                    logger.info("Non-member message sent with SID: %s", response.sid)
                     return Response(
                         content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
                         media_type="application/xml"
@@ -148,111 +350,127 @@ async def whatsapp_webhook(request: Request):
                 
                 user_data = user_result[0]
                 user_id = user_data["id"]
+
+                if should_acknowledge(message_elapsed()):
+                    ack = twilio_send(ACK_MESSAGE, from_number)
+                    logger.info("Acknowledgement sent with SID: %s", ack.sid)
                 
-                active_chat_query = chat_agent.check_active_chat(user_id)
-                logger.info(f"Generated SQL query for active chat: {active_chat_query}")
+                with span("chat_lookup"):
+                    active_chat_query = chat_agent.check_active_chat(user_id)
+                    logger.debug("Generated SQL query for active chat: %s", active_chat_query)
                 
-                active_chat_result = query_database(active_chat_query)
+                    active_chat_result = query_database(active_chat_query)
                 
-                chat_id = None
-                chat_history = []
+                    chat_id = None
+                    chat_history = []
                 
-                if not active_chat_result:
+                    if not active_chat_result:
                     
-                    new_chat_query = chat_agent.create_new_chat(user_id)
-                    logger.info(f"Generated SQL query for new chat: {new_chat_query}")
+                        new_chat_query = chat_agent.create_new_chat(user_id)
+                        logger.debug("Generated SQL query for new chat: %s", new_chat_query)
                     
-                    new_chat_result = query_database(new_chat_query)
-                    if new_chat_result and isinstance(new_chat_result, dict) and "id" in new_chat_result:
-                        chat_id = new_chat_result["id"]
-                        logger.info(f"Created new chat with ID: {chat_id}")
-                    else:
+                        new_chat_result = query_database(new_chat_query)
+                        if new_chat_result and isinstance(new_chat_result, dict) and "id" in new_chat_result:
+                            chat_id = new_chat_result["id"]
+                            logger.info("Created new chat with ID: %s", chat_id)
+                        else:
     
-                        logger.error(f"Failed to create new chat: {new_chat_result}")
-                        response = twilio_client.messages.create(
-                            from_=TWILIO_WHATSAPP_NUMBER,
-                            body="Sorry, I encountered an error setting up your chat session. Please try again later.",
-                            to=from_number
-                        )
-                        return Response(
-                            content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
-                            media_type="application/xml"
-                        )
-                else:
+                            logger.error("Failed to create new chat: %s", new_chat_result)
+                            response = twilio_send("Sorry, I encountered an error setting up your chat session. Please try again later.", from_number)
+                            return Response(
+                                content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
+                                media_type="application/xml"
+                            )
+                    else:
                    
-                    chat_id = active_chat_result[0]["id"]
+                        chat_id = active_chat_result[0]["id"]
                     
                    
-                    chat_history_query = chat_agent.get_chat_messages(chat_id)
-                    logger.info(f"Generated SQL query for chat history: {chat_history_query}")
+                        chat_history_query = chat_agent.get_chat_messages(chat_id)
+                        logger.debug("Generated SQL query for chat history: %s", chat_history_query)
                     
-                    chat_history = query_database(chat_history_query)
+                        chat_history = query_database(chat_history_query)
                     
-                    logger.info(f"Retrieved chat history with {len(chat_history)} messages")
+                        logger.info("Retrieved chat history with %s messages", len(chat_history))
                 
             
-                products_query = data_agent.get_all_products()
-                artists_query = data_agent.get_all_artists()
-                appointments_query = data_agent.get_all_appointments()
+                with span("catalog"):
+                    products_query = data_agent.get_all_products()
+                    artists_query = data_agent.get_all_artists()
+                    appointments_query = data_agent.get_all_appointments()
                 
-                products = query_database(products_query)
-                artists = query_database(artists_query)
-                appointments = query_database(appointments_query)
+                    products = query_database(products_query)
+                    artists = query_database(artists_query)
+                    appointments = query_database(appointments_query)
                 
 
-                formatted_products = formatting_agent.format_products(products)
-                formatted_artists = formatting_agent.format_artists(artists)
-                formatted_appointments = formatting_agent.format_appointments(appointments)
-                
+                    formatted_products = formatting_agent.format_products(products)
+                    formatted_artists = formatting_agent.format_artists(artists)
+                    formatted_appointments = formatting_agent.format_appointments(appointments)
+
+                with span("match"):
+                    hints = selection_hints(body, products, artists)
+                    if hints:
+                        logger.debug("Selection hints: %s", hints)
             
-                agent_response = booking_agent.process_message(
-                    body, 
-                    user_data, 
-                    chat_history, 
-                    formatted_products,  
-                    formatted_artists,   
-                    formatted_appointments  
-                )
+                streamed = []
+                with span("booking_agent") as booking_clock:
+                    tenant = current_tenant()
+                    agent_args = (body, user_data, chat_history, formatted_products, formatted_artists, formatted_appointments)
+                    agent_kwargs = {"persona": tenant.config.persona if tenant else None, "hints": hints}
+                    if STREAM_REPLIES:
+                        # chunks go out while the model is still writing; control replies are held
+                        # back. Sends are timed as twilio_send only, so the stage estimates the
+                        # acknowledgement relies on aren't inflated by them
+                        def send_chunk(text):
+                            with booking_clock.paused():
+                                streamed.append(twilio_send(text, from_number))
+
+                        agent_response, _ = stream_reply(
+                            booking_router.stream_message(*agent_args, **agent_kwargs), send_chunk
+                        )
+                        agent_response = agent_response.strip()
+                    else:
+                        agent_response = booking_router.process_message(*agent_args, **agent_kwargs)
                 
-                logger.info(f"Booking agent response: {agent_response}")
+                logger.info("Booking agent response: %s characters", len(agent_response))
+                logger.debug("Booking agent response: %s", agent_response)
                
-                try:
-                    save_message_query = chat_agent.save_message(
-                        chat_id, user_id, body, agent_response
-                    )
-                    logger.debug(f"Save message query: {save_message_query}")
-                    save_result = query_database(save_message_query)
+                with span("save_message"):
+                    try:
+                        save_message_query = chat_agent.save_message(
+                            chat_id, user_id, body, agent_response
+                        )
+                        logger.debug("Save message query: %s", save_message_query)
+                        save_result = query_database(save_message_query)
                     
-                    if not save_result:
+                        if not save_result:
                       
-                        logger.warning("Failed to save message with agent query, trying direct insert")
-                        direct_save_query = f"""
-                        INSERT INTO messages (chat_id, user_id, user_message, bot_reply, created_at) 
-                        VALUES ({chat_id}, {user_id}, '{body.replace("'", "''")}', '{agent_response.replace("'", "''")}', CURRENT_TIMESTAMP)
-                        """
-                        logger.debug(f"Direct save message query: {direct_save_query}")
-                        direct_save_result = query_database(direct_save_query)
-                        logger.debug(f"Direct save result: {direct_save_result}")
-                    else:
-                        logger.info(f"Message saved successfully with ID: {save_result.get('id', 'unknown')}")
-                except Exception as e:
-                    logger.error(f"Error saving message: {e}", exc_info=True)
+                            logger.warning("Failed to save message with agent query, trying direct insert")
+                            direct_save_query = f"""
+                            INSERT INTO messages (chat_id, user_id, user_message, bot_reply, created_at) 
+                            VALUES ({chat_id}, {user_id}, '{body.replace("'", "''")}', '{agent_response.replace("'", "''")}', CURRENT_TIMESTAMP)
+                            """
+                            logger.debug("Direct save message query: %s", direct_save_query)
+                            direct_save_result = query_database(direct_save_query)
+                            logger.debug("Direct save result: %s", direct_save_result)
+                        else:
+                            logger.info("Message saved successfully with ID: %s", save_result.get('id', 'unknown'))
+                    except Exception as e:
+                        logger.error("Error saving message: %s", e, exc_info=True)
                 
-                    logger.warning("Continuing despite message save failure")
+                        logger.warning("Continuing despite message save failure")
                 
         
                 if agent_response == "FALSE":
                    
-                    end_chat_query = chat_agent.end_chat(chat_id)
-                    query_database(end_chat_query)
+                    with span("end_chat"):
+                        end_chat_query = chat_agent.end_chat(chat_id)
+                        query_database(end_chat_query)
                     
                     goodbye_message = "Thanks! Looking forward to meeting you again."
                     
-                    response = twilio_client.messages.create(
-                        from_=TWILIO_WHATSAPP_NUMBER,
-                        body=goodbye_message,
-                        to=from_number
-                    )
+                    response = twilio_send(goodbye_message, from_number)
                 elif agent_response.startswith("TRUE"):
                    
                     parts = agent_response.split(",")
@@ -286,24 +504,32 @@ async def whatsapp_webhook(request: Request):
                             product_name = "your service"
                     
     
-                    create_appointment_query = data_agent.create_appointment(
-                        user_id, artist_id, product_id, booking_time
-                    )
-                    logger.debug(f"Create appointment query: {create_appointment_query}")
-                    appointment_result = query_database(create_appointment_query)
-                    logger.debug(f"Appointment creation result: {appointment_result}")
+                    with span("create_appointment"):
+                        create_appointment_query = data_agent.create_appointment(
+                            user_id, artist_id, product_id, booking_time
+                        )
+                        logger.debug("Create appointment query: %s", create_appointment_query)
+                        appointment_result = query_database(create_appointment_query)
+                        logger.debug("Appointment creation result: %s", appointment_result)
+                    
+                        if not appointment_result:
+                            direct_query = f"""
+                            INSERT INTO appointments (artist_id, user_id, booking_time, product_id, status)
+                            VALUES ({artist_id}, {user_id}, '{booking_time}', {product_id}, 'booked')
+                            """
+                            logger.debug("Trying direct appointment query: %s", direct_query)
+                            direct_result = query_database(direct_query)
+                            logger.debug("Direct appointment result: %s", direct_result)
+                            appointment_result = direct_result
                     
-                    if not appointment_result:
-                        direct_query = f"""
-                        INSERT INTO appointments (artist_id, user_id, booking_time, product_id, status)
-                        VALUES ({artist_id}, {user_id}, '{booking_time}', {product_id}, 'booked')
-                        """
-                        logger.debug(f"Trying direct appointment query: {direct_query}")
-                        direct_result = query_database(direct_query)
-                        logger.debug(f"Direct appointment result: {direct_result}")
+                        # the scheduler works on the default database only; a
+                        # tenant's appointment id means nothing there
+                        if current_tenant() is None and isinstance(appointment_result, dict) and appointment_result.get("id"):
+                            reminder_scheduler.schedule(appointment_result["id"], booking_time)
                     
-                    end_chat_query = chat_agent.end_chat(chat_id)
-                    query_database(end_chat_query)
+                    with span("end_chat"):
+                        end_chat_query = chat_agent.end_chat(chat_id)
+                        query_database(end_chat_query)
                     
                     confirmation_message = (
                         f"BOOKING CONFIRMED!\n\n"
@@ -313,34 +539,20 @@ async def whatsapp_webhook(request: Request):
                         f"Please arrive 10 minutes before your appointment. We look forward to seeing you!"
                     )
                     
-                    response = twilio_client.messages.create(
-                        from_=TWILIO_WHATSAPP_NUMBER,
-                        body=confirmation_message,
-                        to=from_number
-                    )
+                    response = twilio_send(confirmation_message, from_number)
+                elif streamed:
+                    response = streamed[-1]
                 else:
-                    response = twilio_client.messages.create(
-                        from_=TWILIO_WHATSAPP_NUMBER,
-                        body=agent_response,
-                        to=from_number
-                    )
+                    response = twilio_send(agent_response, from_number)
                 
-                logger.info(f"Response sent with SID: {response.sid}")
+                logger.info("Response sent with SID: %s", response.sid)
                 
             except Exception as e:
-                logger.error(f"Error in processing: {e}", exc_info=True)
-                response = twilio_client.messages.create(
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    body="Sorry, I encountered an error processing your request. Please try again later.",
-                    to=from_number
-                )
+                logger.error("Error in processing: %s", e, exc_info=True)
+                response = twilio_send("Sorry, I encountered an error processing your request. Please try again later.", from_number)
         else:
             logger.warning("No WaId found in the request")
-            response = twilio_client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                body="Sorry, I couldn't identify your phone number.",
-                to=from_number
-            )
+            response = twilio_send("Sorry, I couldn't identify your phone number.", from_number)
 
         return Response(
             content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
@@ -348,7 +560,7 @@ async def whatsapp_webhook(request: Request):
         )
         
     except Exception as e:
-        logger.error(f"Error in WhatsApp webhook: {e}", exc_info=True)
+        logger.error("Error in WhatsApp webhook: %s", e, exc_info=True)
         return Response(
             content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
             media_type="application/xml"
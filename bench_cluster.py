@@ -0,0 +1,196 @@
+"""
+Throughput scaling benchmark for cluster.py.
+
+For each worker count a cluster is started on a scratch database with stub
+agents (loadtest.install_stubs_from_env) and driven over HTTP by concurrent
+simulated users. Each stub agent call does --model-cpu-ms of GIL-holding
+Python work (plus an optional --model-latency-ms of sleeping), so the report
+shows how much extra workers help with CPU-bound request handling; that is
+bounded by the number of cores, reported in meta.cpus. Sleep-only stubs
+overlap on any machine and say little about the cluster itself.
+
+Every level uses its own ports, and the run stops if one of them is already
+taken, so a leftover process can't be measured in place of the new cluster.
+
+Usage:
+    python bench_cluster.py --workers 1,2,4,8 --users 64 --requests 10
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import database
+import loadtest
+from cluster import port_free, wait_for_port
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def drive(port, users, requests_per_user, auth_token):
+    """Send requests_per_user webhook turns for each of `users` concurrent users"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def user(index):
+        phone = loadtest.phone_for(index)
+        conversation = loadtest.DEFAULT_CORPUS[index % len(loadtest.DEFAULT_CORPUS)]
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        for turn in range(requests_per_user):
+            form, signature = loadtest.sign_form(f"http://127.0.0.1:{port}/webhook/whatsapp", {
+                "From": f"whatsapp:{phone}",
+                "To": "whatsapp:+14155238886",
+                "WaId": phone.lstrip("+"),
+                "Body": conversation[turn % len(conversation)],
+            }, auth_token)
+            body = urlencode(form)
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/webhook/whatsapp", body=body, headers={
+                    "Content-Type": "application/x-www-form-urlencoded",
+                    "X-Twilio-Signature": signature,
+                })
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def run_level(workers, args, workdir, number):
+    # fresh ports per level: the previous level's sockets may still be closing
+    port = args.port + number
+    worker_base_port = args.worker_base_port + 100 * number
+    busy = [p for p in [port] + [worker_base_port + i for i in range(workers)] if not port_free(p)]
+    if busy:
+        raise RuntimeError(f"ports {busy} are already in use; stop the old processes or pick other ports")
+    db_file = os.path.join(workdir, f"cluster-{workers}.db")
+    database.DB_FILE = db_file
+    database.init_db()
+    loadtest.seed_users(args.users)
+
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "bench")
+    env.setdefault("TWILIO_ACCOUNT_SID", "AC" + "0" * 32)
+    env.setdefault("TWILIO_AUTH_TOKEN", "bench")
+    env["LOADTEST_MODEL_LATENCY_MS"] = str(args.model_latency_ms)
+    env["LOADTEST_MODEL_CPU_MS"] = str(args.model_cpu_ms)
+    env["LOG_LEVEL"] = "WARNING"
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    # a file rather than a pipe: nothing reads the workers' stderr while they run
+    stderr_path = os.path.join(workdir, f"cluster-{workers}.err")
+    stderr = open(stderr_path, "wb")
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(REPO_DIR, "cluster.py"),
+            "--workers", str(workers),
+            "--host", "127.0.0.1",
+            "--port", str(port),
+            "--worker-base-port", str(worker_base_port),
+            "--db", db_file,
+            "--worker-init", "loadtest:install_stubs_from_env",
+        ],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=stderr,
+    )
+    try:
+        # the dispatcher only listens once every worker is up
+        if not wait_for_port(port, timeout=120) or process.poll() is not None:
+            process.wait(timeout=30)
+            raise RuntimeError(
+                f"cluster with {workers} workers did not start (exit code {process.returncode}): "
+                + open(stderr_path, encoding="utf-8", errors="replace").read()[-2000:]
+            )
+        # one untimed round so every worker has imported and opened everything
+        drive(port, min(args.users, workers * 4), 1, env["TWILIO_AUTH_TOKEN"])
+        latencies, errors, duration = drive(port, args.users, args.requests, env["TWILIO_AUTH_TOKEN"])
+        if process.poll() is not None:
+            raise RuntimeError(f"cluster with {workers} workers exited during the run")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        stderr.close()
+        stale = [p for p in [port] + [worker_base_port + i for i in range(workers)] if not port_free(p)]
+        if stale:
+            raise RuntimeError(f"ports {stale} still in use after the cluster stopped")
+
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration else 0.0,
+        "latency_ms": loadtest.summarize(latencies),
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cluster throughput against worker count")
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated worker counts")
+    parser.add_argument("--users", type=int, default=32, help="Concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=10, help="Webhook turns per user")
+    parser.add_argument("--model-cpu-ms", type=float, default=5.0, help="CPU-bound work per stub agent call")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="Sleeping latency per stub agent call")
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--worker-base-port", type=int, default=19001)
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    levels = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for number, workers in enumerate(int(w) for w in args.workers.split(",") if w.strip()):
+            levels.append(run_level(workers, args, workdir, number))
+
+    baseline = levels[0]["throughput_rps"] / levels[0]["workers"] if levels and levels[0]["throughput_rps"] else 0
+    for level in levels:
+        level["scaling_efficiency"] = (
+            round(level["throughput_rps"] / (baseline * level["workers"]), 3) if baseline else None
+        )
+    report = {
+        "meta": {
+            "commit": loadtest.git_commit(),
+            "cpus": os.cpu_count(),
+            "users": args.users,
+            "requests_per_user": args.requests,
+            "model_cpu_ms": args.model_cpu_ms,
+            "model_latency_ms": args.model_latency_ms,
+        },
+        "levels": levels,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
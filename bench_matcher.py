@@ -0,0 +1,168 @@
+"""
+Service/artist matcher benchmark.
+
+Runs the local matcher over a corpus of noisy user phrasings (typos,
+spacing, British spelling, filler words) labelled with the product and artist
+they should resolve to, against the default seed catalog. Reports index
+build time, per-message match latency and precision/recall for products and
+artists; a label of None means no confident match is expected.
+
+Usage:
+    python bench_matcher.py --repeat 200 --threshold 0.8
+"""
+import argparse
+import json
+import sys
+import time
+
+import loadtest
+import matcher
+
+PRODUCTS = [
+    {"id": 1, "name": "Haircut"},
+    {"id": 2, "name": "Manicure"},
+    {"id": 3, "name": "Facial"},
+    {"id": 4, "name": "Hair Coloring"},
+    {"id": 5, "name": "Massage"},
+]
+
+ARTISTS = [
+    {"id": 1, "name": "John", "expertise": "Hair Styling"},
+    {"id": 2, "name": "Sarah", "expertise": "Nail Care"},
+    {"id": 3, "name": "Emma", "expertise": "Skin Care"},
+    {"id": 4, "name": "Michael", "expertise": "Hair Coloring"},
+    {"id": 5, "name": "Lisa", "expertise": "Massage Therapy"},
+]
+
+# (message, expected product, expected artist)
+CORPUS = [
+    ("facial pls", "Facial", None),
+    ("haircolour", "Hair Coloring", None),
+    ("with emma", None, "Emma"),
+    ("Hi", None, None),
+    ("hello there", None, None),
+    ("what times do you have tomorrow?", None, None),
+    ("CONFIRM", None, None),
+    ("EXIT", None, None),
+    ("i want a haircut", "Haircut", None),
+    ("hair cut with john tomorrow 4pm", "Haircut", "John"),
+    ("can i get a hiarcut", "Haircut", None),
+    ("haricut w jon", "Haircut", "John"),
+    ("manicure with sarah", "Manicure", "Sarah"),
+    ("manicur pls", "Manicure", None),
+    ("mancure", "Manicure", None),
+    ("nails with sara", None, "Sarah"),
+    ("facail", "Facial", None),
+    ("a facial with emma at 3", "Facial", "Emma"),
+    ("facials", "Facial", None),
+    ("hair colouring by michael", "Hair Coloring", "Michael"),
+    ("hair color", "Hair Coloring", None),
+    ("haircolor with micheal", "Hair Coloring", "Michael"),
+    ("hair colours", "Hair Coloring", None),
+    ("massage", "Massage", None),
+    ("masage with lisa", "Massage", "Lisa"),
+    ("massge tomorow", "Massage", None),
+    ("a relaxing massage please", "Massage", None),
+    ("with lisa", None, "Lisa"),
+    ("michael please", None, "Michael"),
+    ("is emma free on friday", None, "Emma"),
+    ("book me in with john", None, "John"),
+    ("how much is a manicure", "Manicure", None),
+    ("thanks so much!", None, None),
+    ("ok see you then", None, None),
+    ("yes that works", None, None),
+    ("can i change my appointment", None, None),
+    ("whats the price list", None, None),
+    ("Facial + Emma", "Facial", "Emma"),
+    ("HAIRCUT JOHN", "Haircut", "John"),
+    ("mani pedi", None, None),
+    # artists asked for by expertise rather than name
+    ("someone for skin care", None, "Emma"),
+    ("skincare specialist please", None, "Emma"),
+    ("nail care tomorrow", None, "Sarah"),
+    ("who does hair styling", None, "John"),
+    ("massage therapy at 5", "Massage", "Lisa"),
+    ("hair coloring", "Hair Coloring", None),
+]
+
+
+def score(expected, found):
+    """(true positive, false positive, false negative) for one label"""
+    if expected is None:
+        return (0, int(found is not None), 0)
+    if found == expected:
+        return (1, 0, 0)
+    return (0, int(found is not None), 1)
+
+
+def rates(tp, fp, fn):
+    return {
+        "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+        "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the local service/artist matcher")
+    parser.add_argument("--repeat", type=int, default=200, help="Passes over the corpus for timing")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--show-misses", action="store_true", help="List corpus entries matched wrongly")
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    catalog_matcher = matcher.CatalogMatcher(PRODUCTS, ARTISTS)
+    build_seconds = time.perf_counter() - start
+
+    totals = {"product": [0, 0, 0], "artist": [0, 0, 0]}
+    misses = []
+    for text, product, artist in CORPUS:
+        result = catalog_matcher.match(text, args.threshold)
+        found = {kind: result[kind].name if result[kind] else None for kind in totals}
+        for kind, expected in (("product", product), ("artist", artist)):
+            for i, value in enumerate(score(expected, found[kind])):
+                totals[kind][i] += value
+        if (found["product"], found["artist"]) != (product, artist):
+            misses.append({"text": text, "expected": [product, artist], "found": [found["product"], found["artist"]]})
+
+    latencies = []
+    for _ in range(args.repeat):
+        for text, _, _ in CORPUS:
+            start = time.perf_counter()
+            catalog_matcher.match(text, args.threshold)
+            latencies.append(time.perf_counter() - start)
+    latency_us = {
+        key: round(value * 1000.0, 1) for key, value in loadtest.summarize(latencies).items() if key != "count"
+    }
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        matcher.get_matcher(PRODUCTS, ARTISTS)
+    cached_lookup_us = (time.perf_counter() - start) / args.repeat * 1e6
+
+    report = {
+        "meta": {
+            "commit": loadtest.git_commit(),
+            "corpus": len(CORPUS),
+            "threshold": args.threshold,
+            "aliases": len(catalog_matcher.aliases),
+        },
+        "build_ms": round(build_seconds * 1000.0, 3),
+        "cached_lookup_us": round(cached_lookup_us, 1),
+        "match_latency_us": latency_us,
+        "product": rates(*totals["product"]),
+        "artist": rates(*totals["artist"]),
+        "exact": round(1 - len(misses) / len(CORPUS), 4),
+    }
+    if args.show_misses:
+        report["misses"] = misses
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Perceived-latency benchmark for slow-turn acknowledgements and streamed replies.
+
+Drives the real webhook in-process (stub agents and a fake Twilio client from
+loadtest.py) with a booking agent stand-in that streams a long reply at a
+fixed time-to-first-token and rate. Each turn is replayed in four modes:
+baseline, acknowledgement only, streaming only, and both. For every turn it
+records when the user got the first outbound message (TTFM) and the last one
+(TTC), relative to the webhook POST.
+
+Usage:
+    python bench_progressive.py --turns 20 --model-latency-ms 300 --first-token-ms 800 --chars-per-second 600
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import loadtest
+import model_router
+
+REPLY = (
+    "Lovely choice! Our signature facial takes about an hour and includes a double cleanse, exfoliation, "
+    "a relaxing massage and a hydrating mask. Emma has openings tomorrow at 10am, 1pm and 4pm. "
+    "If you'd prefer the weekend, Lisa can do Saturday at 11am or 2pm. "
+    "Just let me know which time suits you best and I'll put it in the book. "
+    "When everything looks right, reply CONFIRM and you'll get your booking details straight away. "
+    "You can also reply EXIT at any time to end the chat."
+)
+TURNS = ["hi", "facial pls", "with emma", "tomorrow 4pm", "anything cheaper?", "ok what about saturday"]
+MODES = {
+    "baseline": (False, False),
+    "ack": (True, False),
+    "stream": (False, True),
+    "ack_stream": (True, True),
+}
+
+
+class StreamingStandIn:
+    """Booking agent stand-in: first piece after first_token seconds, then chars_per_second"""
+
+    def __init__(self, first_token, chars_per_second):
+        self.first_token = first_token
+        self.chars_per_second = chars_per_second
+
+    def stream_message(self, user_message, user_data, chat_history, products, artists, appointments,
+                       persona=None, hints=None):
+        time.sleep(self.first_token)
+        for i, word in enumerate(REPLY.split(" ")):
+            piece = word if i == 0 else " " + word
+            time.sleep(len(piece) / self.chars_per_second)
+            yield piece
+
+    def process_message(self, user_message, user_data, chat_history, products, artists, appointments,
+                        persona=None, hints=None):
+        return "".join(self.stream_message(user_message, user_data, chat_history, products, artists, appointments))
+
+
+class TimedTwilioClient(loadtest.FakeTwilioClient):
+    """FakeTwilioClient that also records when each message was accepted"""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.times = []
+        self._times_lock = threading.Lock()
+
+    def _create(self, from_=None, body=None, to=None, **kwargs):
+        response = super()._create(from_=from_, body=body, to=to, **kwargs)
+        with self._times_lock:
+            self.times.append(time.perf_counter())
+        return response
+
+    def drain_times(self):
+        with self._times_lock:
+            times, self.times = self.times, []
+        self.drain()
+        return times
+
+
+def run_turn(app_module, client, text, index):
+    form = {
+        "From": f"whatsapp:{loadtest.phone_for(0)}",
+        "To": "whatsapp:+14155238886",
+        "WaId": loadtest.phone_for(0).lstrip("+"),
+        "Body": text,
+        "NumMedia": "0",
+    }
+    client.drain_times()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        code = asyncio.run(loadtest.post_webhook(app_module.app, form))
+    done = time.perf_counter()
+    times = client.drain_times()
+    return {
+        "ok": code == 200 and bool(times),
+        "ttfm": (times[0] if times else done) - start,
+        "ttc": (times[-1] if times else done) - start,
+        "messages": len(times),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time to first and last reply message per mode")
+    parser.add_argument("--turns", type=int, default=18, help="Measured turns per mode")
+    parser.add_argument("--model-latency-ms", type=float, default=300.0, help="Latency of every other stub agent call")
+    parser.add_argument("--twilio-latency-ms", type=float, default=150.0, help="Latency per outbound send")
+    parser.add_argument("--first-token-ms", type=float, default=800.0, help="Booking agent time to first token")
+    parser.add_argument("--chars-per-second", type=float, default=600.0, help="Booking agent streaming rate")
+    parser.add_argument("--ack-threshold-ms", type=float, default=4000.0, help="Predicted turn time that triggers an ack")
+    parser.add_argument("--time-scale", type=float, default=0.1,
+                        help="Fraction of every latency actually slept (reported times are rescaled)")
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    scale = args.time_scale
+    tmpdir = tempfile.TemporaryDirectory()
+    app_module, _ = loadtest.prepare_app(
+        os.path.join(tmpdir.name, "progressive.db"),
+        args.model_latency_ms / 1000.0 * scale,
+        args.twilio_latency_ms / 1000.0 * scale,
+    )
+    import progressive
+
+    loadtest.seed_users(1)
+    client = app_module.twilio_client = TimedTwilioClient(args.twilio_latency_ms / 1000.0 * scale)
+    backend = StreamingStandIn(args.first_token_ms / 1000.0 * scale, args.chars_per_second / scale)
+    app_module.booking_router = model_router.ModelRouter(
+        [model_router.ModelProfile.from_dict(item) for item in model_router.DEFAULT_PROFILES],
+        backend_factory=lambda profile: backend,
+        policy=model_router.single_tier,
+    )
+    progressive.ACK_THRESHOLD_SECONDS = args.ack_threshold_ms / 1000.0 * scale
+
+    report = {
+        "meta": {
+            "commit": loadtest.git_commit(),
+            "turns": args.turns,
+            "reply_chars": len(REPLY),
+            "model_latency_ms": args.model_latency_ms,
+            "twilio_latency_ms": args.twilio_latency_ms,
+            "first_token_ms": args.first_token_ms,
+            "chars_per_second": args.chars_per_second,
+            "ack_threshold_ms": args.ack_threshold_ms,
+            "time_scale": scale,
+        },
+        "modes": {},
+    }
+    for mode, (ack, stream) in MODES.items():
+        progressive.ACK_ENABLED = ack
+        app_module.STREAM_REPLIES = stream
+        # one unmeasured turn so the stage predictor has seen this mode's booking_agent stage
+        run_turn(app_module, client, TURNS[0], 0)
+        results = [run_turn(app_module, client, TURNS[i % len(TURNS)], i) for i in range(args.turns)]
+        report["modes"][mode] = {
+            "errors": sum(1 for result in results if not result["ok"]),
+            "messages_per_turn": round(sum(result["messages"] for result in results) / len(results), 2),
+            "ttfm_ms": loadtest.summarize([result["ttfm"] / scale for result in results]),
+            "ttc_ms": loadtest.summarize([result["ttc"] / scale for result in results]),
+        }
+    tmpdir.cleanup()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Cost of rejecting forged webhook traffic.
+
+Drives the webhook in-process (stub agents, fake Twilio) with four kinds of
+request: unsigned, signed with the wrong token, a replay of an already
+accepted request, and genuine signed messages. Reports per-request latency
+for each, the status codes returned, and the rejection counters, so the gap
+between a forged request and a real one is visible.
+
+Usage:
+    python bench_rejection.py --requests 2000 --model-latency-ms 50
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import loadtest
+
+
+async def send(asgi_app, form, signature):
+    scope, receive = loadtest.build_request(form)
+    headers = [(name, value) for name, value in scope["headers"] if name != b"x-twilio-signature"]
+    if signature:
+        headers.append((b"x-twilio-signature", signature.encode()))
+    scope["headers"] = headers
+    status = {}
+
+    async def capture(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await asgi_app(scope, receive, capture)
+    return status.get("code", 0)
+
+
+async def run(asgi_app, kind, count):
+    url = "http://localhost/webhook/whatsapp"
+    phone = loadtest.phone_for(0)
+    replayed = None
+    latencies = []
+    statuses = Counter()
+    for i in range(count):
+        form = {"From": f"whatsapp:{phone}", "To": "whatsapp:+14155238886", "WaId": phone.lstrip("+"), "Body": "Hi"}
+        if kind == "unsigned":
+            signature = None
+        elif kind == "bad_signature":
+            form, signature = loadtest.sign_form(url, form, "not-the-token")
+        elif kind == "replay":
+            if replayed is None:
+                replayed = loadtest.sign_form(url, form)
+                await send(asgi_app, *replayed)
+            form, signature = replayed
+        else:
+            form, signature = loadtest.sign_form(url, form)
+        start = time.perf_counter()
+        code = await send(asgi_app, form, signature)
+        latencies.append(time.perf_counter() - start)
+        statuses[code] += 1
+    return {
+        "requests": count,
+        "latency_us": {
+            key: round(value * 1000.0, 1) for key, value in loadtest.summarize(latencies).items() if key != "count"
+        },
+        "statuses": dict(statuses),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cost of rejecting forged webhooks")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per forged kind")
+    parser.add_argument("--valid-requests", type=int, default=50)
+    parser.add_argument("--model-latency-ms", type=float, default=50.0, help="Simulated latency per stub agent call")
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app_module, _ = loadtest.prepare_app(os.path.join(workdir, "bench.db"), args.model_latency_ms / 1000.0, 0.0)
+        loadtest.seed_users(1)
+        results = {}
+        with contextlib.redirect_stdout(sys.stderr):
+            for kind, count in (
+                ("unsigned", args.requests),
+                ("bad_signature", args.requests),
+                ("replay", args.requests),
+                ("valid", args.valid_requests),
+            ):
+                results[kind] = asyncio.run(run(app_module.app, kind, count))
+
+    from tracing import webhook_rejections_total
+
+    report = {
+        "meta": {"commit": loadtest.git_commit(), "model_latency_ms": args.model_latency_ms},
+        "results": results,
+        "rejections": {
+            reason: webhook_rejections_total.value(reason=reason)
+            for reason in ("missing_signature", "invalid_signature", "replay", "body_too_large")
+        },
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Startup-time benchmark.
+
+Measures, in fresh interpreter processes, how long `import app` takes, how
+long the lifespan startup takes, and the time to the first served webhook:
+a signed POST /webhook/whatsapp from a member with stubbed credentials. That
+request builds every lazily constructed agent (phi/Gemini imports included)
+and the Twilio client, so it is where lazy construction costs show up. Only
+the network is replaced: agent methods answer like loadtest.py's stubs and
+the Twilio client's HTTP layer accepts messages locally.
+Exits non-zero when the median of any measurement exceeds its threshold, so
+it can gate CI against startup regressions.
+
+Usage:
+    python bench_startup.py --runs 5 --max-import-ms 1500 --max-first-request-ms 2500
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# runs inside the child process; prints one JSON object of timings in seconds
+CHILD = r"""
+import asyncio, json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+
+import Agents
+import loadtest
+
+# agents are still built by LazyAgent on first use; only their model calls are answered locally
+STUBS = {
+    Agents.SQLAgent: loadtest.StubSQLAgent(0.0),
+    Agents.ChatAgent: loadtest.StubChatAgent(0.0),
+    Agents.DataAgent: loadtest.StubDataAgent(0.0),
+    Agents.BookingAgent: loadtest.StubBookingAgent(0.0),
+    Agents.FormattingAgent: loadtest.StubFormattingAgent(0.0),
+}
+for real, stub in STUBS.items():
+    for name in dir(type(stub)):
+        if not name.startswith("_") and hasattr(real, name):
+            setattr(real, name, (lambda method: lambda self, *args, **kwargs: method(*args, **kwargs))(getattr(stub, name)))
+
+sent = []
+
+class OfflineHttpClient:
+    def request(self, method, uri, params=None, data=None, headers=None, auth=None, timeout=None, allow_redirects=False):
+        from twilio.http.response import Response
+        sent.append((data or {}).get("Body"))
+        return Response(201, json.dumps({"sid": "SM" + "0" * 32, "status": "queued", "body": sent[-1]}))
+
+build_twilio_client = app.get_twilio_client
+
+def get_twilio_client():
+    # the real Client is constructed (and its imports paid) here; only its transport is swapped
+    client = build_twilio_client()
+    client.http_client = OfflineHttpClient()
+    return client
+
+app.get_twilio_client = get_twilio_client
+t_wired = time.perf_counter()
+
+form = {
+    "From": "whatsapp:" + loadtest.phone_for(0),
+    "To": "whatsapp:+14155238886",
+    "WaId": loadtest.phone_for(0).lstrip("+"),
+    "Body": "Hi",
+    "NumMedia": "0",
+}
+
+async def first_request():
+    async with app.app.router.lifespan_context(app.app):
+        t2 = time.perf_counter()
+        code = await loadtest.post_webhook(app.app, form)
+        t3 = time.perf_counter()
+    return t2, t3, code
+
+t2, t3, code = asyncio.run(first_request())
+ok = code == 200 and bool(sent) and not any(body and body.startswith(loadtest.ERROR_REPLY_PREFIXES) for body in sent)
+# the stub wiring between import and startup is left out of every measurement
+print(json.dumps({
+    "import": t1 - t0,
+    "startup": t2 - t_wired,
+    "webhook": t3 - t2,
+    "first_request": (t1 - t0) + (t3 - t_wired),
+    "status": code,
+    "ok": ok,
+}))
+"""
+
+
+def make_template(path):
+    """Initialised database with one member (the child's sender), copied fresh for every run"""
+    import database
+    import loadtest
+
+    database.DB_FILE = path
+    database.init_db()
+    loadtest.seed_users(1)
+
+
+def run_once(workdir, template, warmup):
+    db_file = os.path.join(workdir, "bench.db")
+    shutil.copyfile(template, db_file)
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "bench")
+    env.setdefault("TWILIO_ACCOUNT_SID", "AC" + "0" * 32)
+    env.setdefault("TWILIO_AUTH_TOKEN", "bench")
+    env["WARMUP_ON_STARTUP"] = "1" if warmup else "0"
+    env["DB_FILE"] = db_file
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["LOG_LEVEL"] = "WARNING"
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHILD], cwd=workdir, env=env, stderr=subprocess.DEVNULL, text=True
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark app import and time-to-first-request")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", action="store_true", help="Run with WARMUP_ON_STARTUP=1")
+    parser.add_argument("--max-import-ms", type=float, default=1500.0)
+    parser.add_argument("--max-first-request-ms", type=float, default=2500.0)
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        template = os.path.join(workdir, "template.db")
+        make_template(template)
+        for _ in range(args.runs):
+            samples.append(run_once(workdir, template, args.warmup))
+
+    report = {"runs": args.runs, "warmup": args.warmup}
+    for key in ("import", "startup", "webhook", "first_request"):
+        values = [sample[key] * 1000.0 for sample in samples]
+        report[f"{key}_ms"] = {
+            "median": round(statistics.median(values), 2),
+            "min": round(min(values), 2),
+            "max": round(max(values), 2),
+        }
+    failures = []
+    if report["import_ms"]["median"] > args.max_import_ms:
+        failures.append(f"import {report['import_ms']['median']}ms > {args.max_import_ms}ms")
+    if report["first_request_ms"]["median"] > args.max_first_request_ms:
+        failures.append(f"first request {report['first_request_ms']['median']}ms > {args.max_first_request_ms}ms")
+    if not all(sample["ok"] for sample in samples):
+        failures.append("first webhook did not return 200 with a reply")
+    report["regressions"] = failures
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
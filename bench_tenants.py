@@ -0,0 +1,191 @@
+"""
+Multi-tenant benchmark: one process serving many simulated spas.
+
+Provisions --tenants tenant databases, registers them with a TenantManager
+and replays webhook turns in-process (stub agents, fake Twilio) with a
+Zipf-distributed tenant popularity, so a few spas are busy and most are
+mostly idle. Reports throughput, latency percentiles, LRU hit rate,
+evictions and peak RSS for each --max-open setting. Every setting runs in its
+own process, so its peak RSS isn't inflated by the settings before it.
+
+Usage:
+    python bench_tenants.py --tenants 500 --requests 5000 --max-open 32,128,500
+"""
+import argparse
+import asyncio
+import bisect
+import contextlib
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import loadtest
+import tenants
+
+USERS_PER_TENANT = 3
+CATALOG = {
+    "products": [{"name": "Haircut", "price": 30, "duration": 30}, {"name": "Facial", "price": 50, "duration": 60}],
+    "artists": [{"name": "John", "experience": 5, "expertise": "Hair Styling"},
+                {"name": "Emma", "experience": 10, "expertise": "Skin Care"}],
+}
+
+
+def tenant_number(index):
+    return f"whatsapp:+1800{index:07d}"
+
+
+def provision(count, workdir):
+    configs = []
+    for index in range(count):
+        config = tenants.TenantConfig(
+            name=f"spa-{index}",
+            whatsapp_number=tenant_number(index),
+            db_file=os.path.join(workdir, f"spa-{index}.db"),
+            persona=f"You are the assistant for Spa #{index}.",
+            catalog=CATALOG,
+        )
+        tenants.prepare_tenant_db(config)
+        conn = sqlite3.connect(config.db_file)
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (name, phone, email, is_member) VALUES (?, ?, ?, 1)",
+            [(f"Member {u}", loadtest.phone_for(u), None) for u in range(USERS_PER_TENANT)],
+        )
+        conn.commit()
+        conn.close()
+        configs.append(config)
+    return configs
+
+
+def zipf_sampler(count, exponent, rng):
+    weights = [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+    total = sum(weights)
+    cumulative = []
+    running = 0.0
+    for weight in weights:
+        running += weight / total
+        cumulative.append(running)
+    order = list(range(count))
+    rng.shuffle(order)
+    return lambda: order[min(bisect.bisect_left(cumulative, rng.random()), count - 1)]
+
+
+async def replay(asgi_app, pick_tenant, requests, rng):
+    latencies = []
+    for _ in range(requests):
+        tenant_index = pick_tenant()
+        user = rng.randrange(USERS_PER_TENANT)
+        phone = loadtest.phone_for(user)
+        form = {
+            "From": f"whatsapp:{phone}",
+            "To": tenant_number(tenant_index),
+            "WaId": phone.lstrip("+"),
+            "Body": rng.choice(["Hi", "facial pls", "with emma", "tomorrow 4pm", "CONFIRM", "EXIT"]),
+        }
+        start = time.perf_counter()
+        await loadtest.post_webhook(asgi_app, form)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def run_level(args, workdir, max_open):
+    """One --max-open setting against the tenants provisioned in workdir (run in a fresh process)"""
+    configs = [
+        tenants.TenantConfig(
+            name=f"spa-{index}",
+            whatsapp_number=tenant_number(index),
+            db_file=os.path.join(workdir, f"spa-{index}.db"),
+            persona=f"You are the assistant for Spa #{index}.",
+        )
+        for index in range(args.tenants)
+    ]
+    app_module, _ = loadtest.prepare_app(os.path.join(workdir, f"default-{max_open}.db"), 0.0, 0.0)
+    fake_twilio = app_module.twilio_client
+    tenants.Tenant.twilio_client = lambda self: fake_twilio
+    manager = tenants.TenantManager(configs, max_open=max_open, idle_seconds=3600)
+    app_module.tenant_manager = manager
+    rng = random.Random(args.seed)
+    pick_tenant = zipf_sampler(args.tenants, args.zipf, rng)
+    baseline_rss = rss_mb()
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        latencies = asyncio.run(replay(app_module.app, pick_tenant, args.requests, rng))
+        duration = time.perf_counter() - start
+    stats = manager.stats()
+    lookups = stats["hits"] + stats["misses"]
+    manager.close()
+    return {
+        "max_open": max_open,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "latency_ms": loadtest.summarize(latencies),
+        "lru_hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+        "evictions": stats["evictions"],
+        "open_tenants": stats["open"],
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark multi-tenant routing")
+    parser.add_argument("--tenants", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--max-open", default="32,128,500", help="Comma separated LRU capacities to compare")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of tenant popularity")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    parser.add_argument("--level-workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.level_workdir:
+        # child process for one setting; prints its level as JSON
+        print(json.dumps(run_level(args, args.level_workdir, int(args.max_open))))
+        return 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        provision(args.tenants, workdir)
+        provision_seconds = time.perf_counter() - start
+
+        levels = []
+        for max_open in (int(value) for value in args.max_open.split(",") if value.strip()):
+            child = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__),
+                    "--tenants", str(args.tenants), "--requests", str(args.requests),
+                    "--max-open", str(max_open), "--zipf", str(args.zipf), "--seed", str(args.seed),
+                    "--level-workdir", workdir,
+                ],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, text=True,
+            )
+            levels.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "meta": {
+            "commit": loadtest.git_commit(),
+            "tenants": args.tenants,
+            "zipf": args.zipf,
+            "provision_seconds": round(provision_seconds, 2),
+        },
+        "levels": levels,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
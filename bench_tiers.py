@@ -0,0 +1,141 @@
+"""
+Model tiering benchmark with local stand-in backends.
+
+Replays a corpus of booking conversations through ModelRouter twice, once
+with every turn on the standard profile and once with the local tier policy,
+using stand-in backends whose latency and failure rate are set per tier
+(no model calls are made). Reports the tier mix, per-tier latency, fallback
+rate and estimated cost for both runs.
+
+Usage:
+    python bench_tiers.py --repeat 20 --latency-ms lite=150,standard=600,advanced=2000 --failure-rate lite=0.02
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import loadtest
+import matcher
+import model_router
+from bench_matcher import ARTISTS, PRODUCTS
+from tracing import record_tokens
+
+CONVERSATIONS = [
+    ["Hi", "facial pls", "with emma", "tomorrow 4pm", "CONFIRM", "thanks!"],
+    ["hello", "what services do you have and how much is a massage?", "lisa", "friday at 11am", "CONFIRM"],
+    ["I need to reschedule my manicure from tuesday 3pm to thursday morning, ideally with sarah again", "ok",
+     "CONFIRM", "thank you"],
+    ["hey", "haircut with john", "is 5pm today free or tomorrow at 10am?", "5pm", "CONFIRM", "EXIT"],
+    ["can my friend and I both get a facial at the same time on saturday?", "emma and someone else", "EXIT"],
+    ["Hi there, I'd like to book a hair colouring session please", "michael", "next week monday", "ok", "CONFIRM"],
+    ["cancel my appointment", "yes", "bye"],
+    ["massage with lisa", "2pm or 4pm?", "ok both work", "4pm", "CONFIRM", "thanks, see you later!"],
+    ["hi", "pedicure", "saturday 10am", "CONFIRM", "ok cool, talk later"],
+]
+
+
+class StandInBackend:
+    """Replaces BookingAgent for one profile: sleeps, sometimes fails, reports token usage"""
+
+    def __init__(self, profile, latency, failure_rate, rng):
+        self.profile = profile
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng
+
+    def process_message(self, user_message, user_data, chat_history, products, artists, appointments,
+                        persona=None, hints=None):
+        time.sleep(self.latency)
+        if self.rng.random() < self.failure_rate:
+            raise RuntimeError(f"{self.profile.name} stand-in failure")
+        reply = f"[{self.profile.name}] Happy to help with that!"
+        record_tokens(
+            model_router.estimate_tokens(user_message, chat_history, products, artists, appointments) + 600,
+            min(self.profile.max_output_tokens, 120),
+        )
+        return reply
+
+
+def parse_per_tier(value, default):
+    result = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, number = item.split("=", 1)
+            result[name.strip()] = float(number)
+    return lambda name: result.get(name, default)
+
+
+def replay(router, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for conversation in CONVERSATIONS:
+            history = []
+            for turn in conversation:
+                hints = matcher.selection_hints(turn, PRODUCTS, ARTISTS)
+                start = time.perf_counter()
+                try:
+                    reply = router.process_message(turn, {"name": "Bench"}, history, PRODUCTS, ARTISTS, [], hints=hints)
+                except RuntimeError:
+                    reply = ""
+                latencies.append(time.perf_counter() - start)
+                history.append({"user_message": turn, "bot_reply": reply})
+    return latencies
+
+
+def run(policy, args, latency_for, failure_for):
+    rng = random.Random(args.seed)
+    profiles = [model_router.ModelProfile.from_dict(item) for item in model_router.DEFAULT_PROFILES]
+    router = model_router.ModelRouter(
+        profiles,
+        backend_factory=lambda profile: StandInBackend(profile, latency_for(profile.name) / 1000.0 * args.time_scale,
+                                                       failure_for(profile.name), rng),
+        policy=policy,
+    )
+    latencies = replay(router, args.repeat)
+    stats = router.stats()
+    for tier in stats["profiles"].values():
+        for key in ("mean_ms", "max_ms"):
+            if tier[key] is not None:
+                tier[key] = round(tier[key] / args.time_scale, 2)
+    total_cost = sum(tier["cost_usd"] for tier in stats["profiles"].values())
+    return {
+        "turns": len(latencies),
+        "turn_latency_ms": loadtest.summarize([value / args.time_scale for value in latencies]),
+        "cost_usd": round(total_cost, 6),
+        "cost_per_1k_turns_usd": round(total_cost / len(latencies) * 1000, 4),
+        "tiers": stats["profiles"],
+        "reasons": stats["reasons"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare single-tier and tiered booking agent routing")
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the conversation corpus")
+    parser.add_argument("--latency-ms", default="lite=150,standard=600,advanced=2000",
+                        help="Stand-in latency per tier")
+    parser.add_argument("--failure-rate", default="lite=0.02", help="Stand-in failure rate per tier")
+    parser.add_argument("--time-scale", type=float, default=0.01,
+                        help="Fraction of the stand-in latency actually slept (reported latencies are rescaled)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report here as well as stdout")
+    args = parser.parse_args(argv)
+
+    latency_for = parse_per_tier(args.latency_ms, 600.0)
+    failure_for = parse_per_tier(args.failure_rate, 0.0)
+    report = {
+        "meta": {"commit": loadtest.git_commit(), "latency_ms": args.latency_ms, "failure_rate": args.failure_rate},
+        "single_tier": run(model_router.single_tier, args, latency_for, failure_for),
+        "tiered": run(model_router.classify_turn, args, latency_for, failure_for),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Bulk streaming import/export for users, products, artists and appointments.
+
+Files are read and written row by row (CSV or JSONL), inserted with
+executemany in fixed-size chunks and committed in large transactions, so
+memory use doesn't depend on file size. Users are upserted on their phone
+number; the other tables upsert on `id` when the file has one and append
+otherwise. Secondary indexes of the target table are dropped for the load and
+rebuilt once at the end, followed by a single ANALYZE. Appointment imports
+likewise skip the per-row booking rollup triggers and rebuild
+`booking_rollups` in one pass afterwards (see analytics.py).
+
+Imports are safe to run while the app is live. The trg_version_* triggers
+stay in place, so every committed chunk bumps table_versions in its own
+transaction and neither the app's writes nor the imported rows are served
+stale from the query cache. If an appointment import is killed, the next
+init_db restores the rollup triggers and rebuilds the rollups.
+
+Usage:
+    python bulk.py import users members.csv
+    python bulk.py import appointments history.jsonl --chunk-size 10000
+    python bulk.py export users users.csv
+    python bulk.py export appointments -            (JSONL to stdout)
+"""
+import argparse
+import csv
+import itertools
+import json
+import sqlite3
+import sys
+import time
+
+import database
+from analytics import rebuild_rollups
+
+TABLES = {
+    "users": {
+        "columns": ["id", "name", "phone", "email", "is_member", "is_deleted", "created_at"],
+        "import_columns": ["name", "phone", "email", "is_member", "is_deleted"],
+        "key": "phone",
+    },
+    "products": {
+        "columns": ["id", "name", "price", "duration"],
+        "import_columns": ["id", "name", "price", "duration"],
+        "key": "id",
+    },
+    "artists": {
+        "columns": ["id", "name", "experience", "expertise"],
+        "import_columns": ["id", "name", "experience", "expertise"],
+        "key": "id",
+    },
+    "appointments": {
+        "columns": ["id", "artist_id", "user_id", "booking_time", "product_id", "status", "created_at", "reminded_at"],
+        "import_columns": ["id", "artist_id", "user_id", "booking_time", "product_id", "status", "reminded_at"],
+        "key": "id",
+    },
+}
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_rows(f, fmt):
+    """Yield dicts from an open CSV or JSONL file, one row at a time"""
+    if fmt == "csv":
+        for row in csv.DictReader(f):
+            yield {key: (value if value != "" else None) for key, value in row.items()}
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def upsert_statement(table, columns):
+    spec = TABLES[table]
+    key = spec["key"]
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != key)
+    placeholders = ", ".join("?" for _ in columns)
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    if key in columns and updates:
+        statement += f" ON CONFLICT({key}) DO UPDATE SET {updates}"
+    return statement
+
+
+def _secondary_indexes(conn, table):
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+
+
+def _deferred_triggers(conn, table):
+    # the booking rollup updates; one rollup rebuild at the end does the same
+    # job. The cache version triggers stay, since the app may be writing to the
+    # table during the load and its writes must still invalidate the cache.
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? "
+        "AND name LIKE 'trg_rollup_%'",
+        (table,),
+    ).fetchall()
+
+
+def import_rows(table, rows, columns, chunk_size=5000, chunks_per_transaction=20, defer_indexes=True):
+    """
+    Upsert an iterable of dict rows into `table`.
+
+    Parameters:
+    table (str): One of TABLES.
+    rows (iterable): Dict rows, consumed lazily.
+    columns (list): Columns to write; keys missing from a row are written as NULL.
+    chunk_size (int): Rows per executemany call.
+    chunks_per_transaction (int): Chunks committed together.
+    defer_indexes (bool): Drop secondary indexes (and the rollup triggers) during the load and
+        rebuild them once at the end.
+
+    Returns:
+    dict: Row count, elapsed seconds and rows per second.
+    """
+    spec = TABLES[table]
+    columns = [column for column in columns if column in spec["import_columns"]]
+    if table == "users" and "phone" not in columns:
+        raise ValueError("users import needs a phone column")
+    statement = upsert_statement(table, columns)
+
+    conn = sqlite3.connect(database.DB_FILE, timeout=30)
+    start = time.perf_counter()
+    count = 0
+    indexes = _secondary_indexes(conn, table) if defer_indexes else []
+    triggers = _deferred_triggers(conn, table) if defer_indexes else []
+    try:
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        for name, _ in triggers:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.commit()
+        for number, chunk in enumerate(chunked(rows, chunk_size), 1):
+            conn.executemany(statement, [tuple(row.get(column) for column in columns) for row in chunk])
+            count += len(chunk)
+            if number % chunks_per_transaction == 0:
+                conn.commit()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # the indexes come back even if the load failed part way
+        for _, sql in indexes:
+            conn.execute(sql)
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+        if triggers:
+            rebuild_rollups(conn)
+        conn.execute(f"ANALYZE {table}")
+        conn.close()
+    elapsed = time.perf_counter() - start
+    return {"table": table, "rows": count, "seconds": round(elapsed, 3), "rows_per_second": round(count / elapsed, 1) if elapsed else None}
+
+
+def import_file(table, path, fmt=None, **kwargs):
+    fmt = detect_format(path, fmt)
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = read_rows(f, fmt)
+        first = next(rows, None)
+        if first is None:
+            return {"table": table, "rows": 0, "seconds": 0.0, "rows_per_second": None}
+        return import_rows(table, itertools.chain([first], rows), list(first.keys()), **kwargs)
+
+
+def export_table(table, out, fmt="jsonl", fetch_size=5000):
+    """Stream every row of `table` to an open text file; returns the summary dict"""
+    columns = TABLES[table]["columns"]
+    conn = sqlite3.connect(database.DB_FILE, timeout=30)
+    start = time.perf_counter()
+    count = 0
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                break
+            if writer:
+                writer.writerows(batch)
+            else:
+                out.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch)
+            count += len(batch)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    return {"table": table, "rows": count, "seconds": round(elapsed, 3), "rows_per_second": round(count / elapsed, 1) if elapsed else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of spa data")
+    parser.add_argument("--db", help="Database file (defaults to DB_FILE / spa_booking.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="Upsert rows from a CSV/JSONL file")
+    importer.add_argument("table", choices=sorted(TABLES))
+    importer.add_argument("path")
+    importer.add_argument("--format", choices=["csv", "jsonl"])
+    importer.add_argument("--chunk-size", type=int, default=5000)
+    importer.add_argument("--chunks-per-transaction", type=int, default=20)
+    importer.add_argument("--keep-indexes", action="store_true", help="Maintain indexes row by row instead of rebuilding")
+
+    exporter = commands.add_parser("export", help="Write a table as CSV/JSONL")
+    exporter.add_argument("table", choices=sorted(TABLES))
+    exporter.add_argument("path", help="Output file, or - for stdout")
+    exporter.add_argument("--format", choices=["csv", "jsonl"])
+
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DB_FILE = args.db
+    database.init_db()
+
+    if args.command == "import":
+        summary = import_file(
+            args.table, args.path, args.format,
+            chunk_size=args.chunk_size,
+            chunks_per_transaction=args.chunks_per_transaction,
+            defer_indexes=not args.keep_indexes,
+        )
+    elif args.path == "-":
+        summary = export_table(args.table, sys.stdout, args.format or "jsonl")
+    else:
+        with open(args.path, "w", newline="", encoding="utf-8") as f:
+            summary = export_table(args.table, f, detect_format(args.path, args.format))
+    print(json.dumps(summary), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
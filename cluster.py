@@ -0,0 +1,307 @@
+"""
+Multi-process deployment with user-affinity sharding.
+
+    dispatcher (this process, port 8001)
+        |  crc32(WaId) % N
+        +--> worker 0 (uvicorn app:app, 127.0.0.1:9001) --+
+        +--> worker 1 (uvicorn app:app, 127.0.0.1:9002) --+--> writer process --> spa_booking.db
+        +--> ...                                         --+
+
+Each webhook goes to the worker picked by a stable hash of the sender's WaId,
+so a user's conversation, and anything cached for it, stays in one process.
+Workers read the database directly (in WAL mode, so reads never wait on the
+writer), while every INSERT/UPDATE/DELETE is sent over a queue to a single
+writer process, which removes contention for SQLite's write lock.
+
+Requests to any other path are forwarded to worker 0; each worker's own
+port can also be scraped directly for /metrics.
+
+Usage:
+    python cluster.py --workers 4 --port 8001
+"""
+import argparse
+import http.client
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "content-length", "upgrade"}
+
+# how long a worker waits for the writer to apply one statement
+WRITE_TIMEOUT_SECONDS = float(os.getenv("CLUSTER_WRITE_TIMEOUT_SECONDS", "30"))
+
+
+def shard_for(key, workers):
+    """Stable worker index for a user key (unlike hash(), identical in every process)"""
+    return zlib.crc32(key.encode("utf-8")) % workers
+
+
+class WriteClient:
+    """
+    Worker side of the writer queue. One request is in flight per worker at a
+    time, so replies on the worker's own response queue can't be interleaved.
+    """
+
+    def __init__(self, worker_index, request_queue, response_queue, writer_pid=None, timeout=WRITE_TIMEOUT_SECONDS):
+        self.worker_index = worker_index
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.writer_pid = writer_pid
+        self.timeout = timeout
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def writer_alive(self):
+        if self.writer_pid is None:
+            return True
+        try:
+            os.kill(self.writer_pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def __call__(self, query, params=None, fetch=True):
+        with self._lock:
+            request_id = next(self._ids)
+            self.request_queue.put((self.worker_index, request_id, query, params, fetch))
+            deadline = time.monotonic() + self.timeout
+            while True:
+                # wake up every second to notice a dead writer; a late reply to
+                # an abandoned request is skipped by the id check
+                try:
+                    reply_id, result, error = self.response_queue.get(timeout=1.0)
+                except queue.Empty:
+                    if not self.writer_alive():
+                        raise RuntimeError(f"Database writer process (pid {self.writer_pid}) is not running")
+                    if time.monotonic() >= deadline:
+                        raise RuntimeError(f"Database writer did not answer within {self.timeout:.0f}s")
+                    continue
+                if reply_id == request_id:
+                    break
+        if error:
+            name, message = error
+            error_type = getattr(sqlite3, name, None)
+            if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+                error_type = RuntimeError
+            raise error_type(message)
+        return result
+
+
+def writer_main(db_file, request_queue, response_queues):
+    """Apply writes from every worker, one at a time, on a single connection path"""
+    os.environ["DB_FILE"] = db_file
+    import database
+
+    database.DB_FILE = db_file
+    while True:
+        item = request_queue.get()
+        if item is None:
+            break
+        worker_index, request_id, query, params, fetch = item
+        try:
+            reply = (request_id, database.execute_query(query, params, fetch), None)
+        except Exception as e:
+            reply = (request_id, None, (type(e).__name__, str(e)))
+        response_queues[worker_index].put(reply)
+
+
+def _load_hook(spec):
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def worker_main(index, port, db_file, request_queue, response_queue, worker_init=None, writer_pid=None):
+    os.environ["DB_FILE"] = db_file
+    if index != 0:
+        # reminders are sent from worker 0 only
+        os.environ["REMINDERS_ENABLED"] = "0"
+    import uvicorn
+    import database
+
+    database.DB_FILE = db_file
+    database.set_write_executor(WriteClient(index, request_queue, response_queue, writer_pid))
+    import app as app_module
+
+    if worker_init:
+        _load_hook(worker_init)(app_module)
+    uvicorn.run(
+        app_module.app,
+        host="127.0.0.1",
+        port=port,
+        proxy_headers=True,
+        forwarded_allow_ips="127.0.0.1",
+        log_level="warning",
+    )
+
+
+def _forward(port, method, path, headers, body, timeout):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        content = response.read()
+        response_headers = [
+            (name, value) for name, value in response.getheaders() if name.lower() not in HOP_BY_HOP
+        ]
+        return response.status, response_headers, content
+    finally:
+        conn.close()
+
+
+def create_dispatcher(worker_ports, timeout=120.0):
+    """FastAPI app that forwards each request to the worker owning its user"""
+    from fastapi import FastAPI, Request, Response
+    from starlette.concurrency import run_in_threadpool
+
+    dispatcher = FastAPI()
+
+    @dispatcher.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+    async def forward(request: Request, path: str):
+        body = await request.body()
+        port = worker_ports[0]
+        if request.url.path == "/webhook/whatsapp":
+            form = parse_qs(body.decode("utf-8", "replace"))
+            key = (form.get("WaId") or form.get("From") or [""])[0]
+            port = worker_ports[shard_for(key, len(worker_ports))]
+
+        # Host is passed through unchanged so workers see the public URL
+        # (Twilio signs the URL it posted to)
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP}
+        headers["X-Forwarded-Proto"] = request.url.scheme
+        if request.client:
+            headers["X-Forwarded-For"] = request.client.host
+        target = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        try:
+            status, response_headers, content = await run_in_threadpool(
+                _forward, port, request.method, target, headers, body, timeout
+            )
+        except OSError as e:
+            logger.error("Worker on port %s unreachable: %s", port, e)
+            return Response(status_code=502)
+        response = Response(content=content, status_code=status)
+        for name, value in response_headers:
+            response.headers.append(name, value)
+        return response
+
+    return dispatcher
+
+
+def port_free(port, host="127.0.0.1"):
+    """True if nothing is listening on `port` (so a new server there won't fail to bind)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return False
+    return True
+
+
+def _exit_on_signal(signum, frame):
+    # uvicorn re-raises SIGTERM after its own graceful shutdown; turning it into
+    # SystemExit lets run_cluster's cleanup stop the workers and the writer
+    raise SystemExit(128 + signum)
+
+
+def wait_for_port(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def run_cluster(workers, host="0.0.0.0", port=8001, worker_base_port=9001, worker_init=None, db_file=None):
+    import uvicorn
+    import database
+
+    db_file = os.path.abspath(db_file or database.DB_FILE)
+    database.DB_FILE = db_file
+    # create and seed the schema once here; workers starting together would race on it
+    database.init_db()
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    worker_ports = [worker_base_port + i for i in range(workers)]
+    # a leftover listener would answer wait_for_port for a worker that failed to bind
+    busy = [p for p in worker_ports if not port_free(p)] + ([] if port_free(port, host) else [port])
+    if busy:
+        raise RuntimeError(f"Ports already in use: {busy}")
+
+    ctx = multiprocessing.get_context("spawn")
+    request_queue = ctx.Queue()
+    response_queues = [ctx.Queue() for _ in range(workers)]
+    writer = ctx.Process(
+        target=writer_main, args=(db_file, request_queue, response_queues), name="beaubot-writer", daemon=True
+    )
+    processes = [writer]
+    previous_handlers = {sig: signal.signal(sig, _exit_on_signal) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        writer.start()
+        for index, worker_port in enumerate(worker_ports):
+            process = ctx.Process(
+                target=worker_main,
+                args=(index, worker_port, db_file, request_queue, response_queues[index], worker_init, writer.pid),
+                name=f"beaubot-worker-{index}",
+                daemon=True,
+            )
+            processes.append(process)
+            process.start()
+        for process, worker_port in zip(processes[1:], worker_ports):
+            if not wait_for_port(worker_port) or not process.is_alive():
+                raise RuntimeError(f"Worker on port {worker_port} did not start (exit code {process.exitcode})")
+        logger.info("Dispatching to %s workers on ports %s", workers, worker_ports)
+        uvicorn.run(create_dispatcher(worker_ports), host=host, port=port, log_level="warning")
+    finally:
+        for process in processes[1:]:
+            if process.is_alive():
+                process.terminate()
+        if writer.is_alive():
+            request_queue.put(None)
+        for process in processes:
+            if process.pid is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the webhook across several worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--worker-base-port", type=int, default=9001)
+    parser.add_argument("--db", help="Database file (defaults to DB_FILE / spa_booking.db)")
+    parser.add_argument("--worker-init", help="module:function called with the app module in each worker")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    run_cluster(args.workers, args.host, args.port, args.worker_base_port, args.worker_init, args.db)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,295 @@
 import sqlite3
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from tracing import db_span, query_cache_total
 
-DB_FILE = "spa_booking.db"
+DB_FILE = os.getenv("DB_FILE", "spa_booking.db")
+# how long a statement waits for a locked database before failing (sqlite3's default)
+BUSY_TIMEOUT_SECONDS = float(os.getenv("DB_BUSY_TIMEOUT_SECONDS", "5"))
 
-def init_db():
-    """Initialize the database with required tables"""
-    db_exists = os.path.exists(DB_FILE)
+# When set (see cluster.py), statements other than SELECT are handed to this
+# callable instead of being run on a local connection, so that every write
+# goes through a single writer process.
+_write_executor = None
+
+def set_write_executor(executor):
+    """Route writes through `executor(query, params, fetch)`; None restores local writes"""
+    global _write_executor
+    _write_executor = executor
+
+# Tables whose writes bump table_versions (via the triggers created in init_db)
+VERSIONED_TABLES = ("users", "chats", "messages", "products", "artists", "appointments", "chat_archive_index",
+                    "booking_rollups")
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_MAX_ROWS = int(os.getenv("QUERY_CACHE_MAX_ROWS", "500"))
+# results of queries using 'now' / CURRENT_* are also keyed by a time bucket this long
+QUERY_CACHE_NOW_SECONDS = float(os.getenv("QUERY_CACHE_NOW_SECONDS", "5"))
+
+# the table list after FROM/JOIN, including comma joins ("FROM a x, b AS y");
+# a subquery's "FROM (" is matched on its own and its inner FROM separately
+_TABLE_NAME = r"[\"`\[]?[A-Za-z_][A-Za-z0-9_]*[\"`\]]?(?:\s+(?:as\s+)?[A-Za-z_][A-Za-z0-9_]*)?"
+_TABLE_REF = re.compile(rf"\b(?:from|join)\s+(\(|{_TABLE_NAME}(?:\s*,\s*{_TABLE_NAME})*)", re.IGNORECASE)
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_TIME_DEPENDENT = re.compile(r"'now'|\bcurrent_(?:date|time|timestamp)\b", re.IGNORECASE)
+_UNCACHEABLE = re.compile(r"\b(?:random|randomblob|changes|last_insert_rowid|total_changes)\s*\(", re.IGNORECASE)
+
+class TableVersions:
+    """
+    Per-table write counters of one database file, as seen from this process.
+
+    Triggers bump table_versions on every INSERT/UPDATE/DELETE, whoever makes
+    it (this process, the cluster writer, bulk.py, retention.py). A dedicated
+    connection polls PRAGMA data_version, which only changes after another
+    connection has committed, so the counters are re-read only after a write.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._versions = {}
+        has_table = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'table_versions'"
+        ).fetchone()
+        self.available = has_table is not None
+
+    def current(self):
+        """{table: version}, re-read only if the database changed since the last call"""
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._versions = dict(self._conn.execute("SELECT name, version FROM table_versions"))
+                self._data_version = data_version
+            return self._versions
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class QueryCache:
+    """
+    LRU of SELECT results keyed by (database, normalized SQL, params).
+
+    Each entry remembers the versions of the tables it read; once any of them
+    has moved on the entry is stale, so results stay correct after writes
+    while repeated reads of unchanged tables come from memory.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, max_rows=QUERY_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key_for(self, db_file, query, params):
+        """(cache key, tables read), or (None, None) for a statement that can't be cached"""
+        if _UNCACHEABLE.search(query):
+            return None, None
+        referenced = set()
+        for table_list in _TABLE_REF.findall(query):
+            if table_list != "(":
+                referenced.update(_IDENTIFIER.match(item.strip(' "`[')).group().lower() for item in table_list.split(","))
+        # unknown names (CTEs, sqlite_master, table functions, ...) aren't versioned
+        if not referenced or any(table not in VERSIONED_TABLES for table in referenced):
+            return None, None
+        # any versioned table named anywhere in the statement counts too: an
+        # unneeded dependency only costs an early invalidation, a missed one
+        # serves stale rows
+        words = {word.lower() for word in _IDENTIFIER.findall(query)}
+        tables = tuple(sorted(referenced | (words & set(VERSIONED_TABLES))))
+        normalized = " ".join(query.split()).rstrip(";")
+        bucket = int(time.time() // QUERY_CACHE_NOW_SECONDS) if _TIME_DEPENDENT.search(query) else None
+        if not params:
+            params = ()
+        elif isinstance(params, Mapping):
+            # named parameters: tuple(params) would keep only the names
+            params = tuple(sorted(params.items()))
+        else:
+            params = tuple(params)
+        return (db_file, normalized, params, bucket), tables
+
+    def get(self, key, tables, versions):
+        snapshot = tuple(versions.get(table, 0) for table in tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == snapshot:
+                self._entries.move_to_end(key)
+                self._count(tables, "hit")
+                # callers may modify the rows they get back
+                return [dict(row) for row in entry[1]]
+            if entry is not None:
+                del self._entries[key]
+                self._count(tables, "stale")
+            else:
+                self._count(tables, "miss")
+        return None
+
+    def put(self, key, tables, versions, rows):
+        if len(rows) > self.max_rows:
+            return
+        snapshot = tuple(versions.get(table, 0) for table in tables)
+        with self._lock:
+            self._entries[key] = (snapshot, [dict(row) for row in rows])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, tables, result):
+        for table in tables:
+            counts = self._stats.setdefault(table, {"hit": 0, "miss": 0, "stale": 0})
+            counts[result] += 1
+            query_cache_total.inc(table=table, result=result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            tables = {}
+            for table, counts in sorted(self._stats.items()):
+                lookups = counts["hit"] + counts["miss"] + counts["stale"]
+                tables[table] = dict(counts, hit_rate=round(counts["hit"] / lookups, 4) if lookups else None)
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "tables": tables}
+
+query_cache = QueryCache()
+
+class ConnectionPool:
+    """A few reusable connections to one database file (used per tenant, see tenants.py)"""
+
+    def __init__(self, db_file, size=2, cache_kib=1024):
+        self.db_file = db_file
+        self.size = size
+        self.cache_kib = cache_kib
+        self._idle = []
+        self._lock = threading.Lock()
+        self._versions = None
+        self._closed = False
+
+    def versions(self):
+        """TableVersions watcher for this pool's database, opened on first use"""
+        with self._lock:
+            if self._versions is None:
+                self._versions = TableVersions(self.db_file)
+            return self._versions
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_kib)}")
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            # a connection handed back after close() is closed, not pooled
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            versions, self._versions = self._versions, None
+        for conn in idle:
+            conn.close()
+        if versions is not None:
+            versions.close()
+
+# Pool that execute_query uses in the current context instead of DB_FILE
+_active_pool = ContextVar("active_pool", default=None)
+
+@contextmanager
+def use_pool(pool):
+    """Run the enclosed execute_query calls against `pool`'s database"""
+    token = _active_pool.set(pool)
+    try:
+        yield pool
+    finally:
+        _active_pool.reset(token)
+
+# TableVersions of the DB_FILE database; pools keep their own
+_default_versions = None
+_default_versions_lock = threading.Lock()
+
+def _versions_for(pool):
+    global _default_versions
+    if pool is not None:
+        return pool.versions()
+    with _default_versions_lock:
+        if _default_versions is None or _default_versions.db_file != DB_FILE:
+            if _default_versions is not None:
+                _default_versions.close()
+            _default_versions = TableVersions(DB_FILE)
+        return _default_versions
+
+def rollup_delta(row, sign):
+    """
+    Trigger statement adding (sign=1) or removing (sign=-1) one appointment's
+    contribution to its booking_rollups cell.
+
+    Parameters:
+    row (str): "NEW" or "OLD".
+    sign (int): 1 or -1.
+    """
+    status = f"lower({row}.status)"
+    return f'''
+            INSERT INTO booking_rollups (day, artist_id, product_id, bookings, completed, cancelled)
+            VALUES (
+                COALESCE(date({row}.booking_time), 'unknown'), {row}.artist_id, {row}.product_id,
+                {sign} * ({status} IS NOT 'cancelled'), {sign} * ({status} IS 'completed'), {sign} * ({status} IS 'cancelled')
+            )
+            ON CONFLICT (day, artist_id, product_id) DO UPDATE SET
+                bookings = bookings + excluded.bookings,
+                completed = completed + excluded.completed,
+                cancelled = cancelled + excluded.cancelled;'''
+
+def current_db_file():
+    """Database file execute_query is using in this context"""
+    pool = _active_pool.get()
+    return pool.db_file if pool is not None else DB_FILE
+
+def current_versions():
+    """{table: write counter} of the database execute_query is using in this context"""
+    return _versions_for(_active_pool.get()).current()
+
+def init_db(db_file=None, seed=True):
+    """
+    Initialize the database with required tables.
+
+    Parameters:
+    db_file (str): Database to initialize; defaults to DB_FILE.
+    seed (bool): Insert the sample users, products and artists into a new database.
+    """
+    db_file = db_file or DB_FILE
+    db_exists = os.path.exists(db_file)
     
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
     
+    if not db_exists:
+        # must be set before the first table is created; lets retention.py
+        # hand freed pages back to the OS a few at a time
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -80,7 +359,99 @@ def init_db():
     )
     ''')
     
-    if not db_exists:
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_archive_index (
+        chat_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        segment TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        message_count INTEGER NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # end of the committed part of each archive segment, written in the same
+    # transaction as chat_archive_index (see retention.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_segments (
+        segment TEXT PRIMARY KEY,
+        committed_size INTEGER NOT NULL
+    )
+    ''')
+    
+    appointment_columns = [row[1] for row in cursor.execute("PRAGMA table_info(appointments)")]
+    if "reminded_at" not in appointment_columns:
+        cursor.execute("ALTER TABLE appointments ADD COLUMN reminded_at TIMESTAMP")
+
+    # appointment counts per (day, artist, service), kept current by the
+    # trg_rollup_* triggers below; see analytics.py
+    rollups_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'booking_rollups'"
+    ).fetchone() is not None
+    rollup_triggers_exist = cursor.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_rollup_appointments_%'"
+    ).fetchone()[0] == 3
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS booking_rollups (
+        day TEXT NOT NULL,
+        artist_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        bookings INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        cancelled INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, artist_id, product_id)
+    ) WITHOUT ROWID
+    ''')
+    for name, operation, body in (
+        ("insert", "INSERT", rollup_delta("NEW", 1)),
+        ("update", "UPDATE OF artist_id, product_id, booking_time, status",
+         rollup_delta("OLD", -1) + rollup_delta("NEW", 1)),
+        ("delete", "DELETE", rollup_delta("OLD", -1)),
+    ):
+        when = (
+            "WHEN OLD.artist_id IS NOT NEW.artist_id OR OLD.product_id IS NOT NEW.product_id "
+            "OR OLD.booking_time IS NOT NEW.booking_time OR OLD.status IS NOT NEW.status"
+        ) if name == "update" else ""
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_appointments_{name}
+        AFTER {operation} ON appointments
+        {when}
+        BEGIN
+            {body}
+        END
+        ''')
+    if not rollups_exist or not rollup_triggers_exist:
+        # first run against a database that already has bookings, or a
+        # bulk.py appointment import was killed while its triggers were dropped
+        from analytics import rebuild_rollups
+        rebuild_rollups(conn)
+
+    # write counters for the SELECT result cache, bumped by triggers so that
+    # writes from any process or tool invalidate it
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    for table in VERSIONED_TABLES:
+        cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)", (table,))
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{operation.lower()}
+            AFTER {operation} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+            END
+            ''')
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_status_time ON appointments (status, booking_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chats_status_updated ON chats (status, updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages (chat_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_archive_user ON chat_archive_index (user_id)")
+    
+    if not db_exists and seed:
         cursor.execute('''
         INSERT INTO users (name, phone, email, is_member) VALUES 
         ('Zain Raza', '+923065187343', 'zainxaidi2003@gmail.com', 1),
@@ -112,8 +483,39 @@ def init_db():
 
 def execute_query(query, params=None, fetch=True):
     """Execute an SQL query and return results if needed"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row  
+    with db_span(query):
+        is_select = query.strip().upper().startswith("SELECT")
+        if _write_executor is not None and _active_pool.get() is None and not is_select:
+            return _write_executor(query, params, fetch)
+        if is_select and fetch and query_cache.enabled:
+            return _cached_select(query, params)
+        return _execute_query(query, params, fetch)
+
+def _cached_select(query, params):
+    pool = _active_pool.get()
+    key, tables = query_cache.key_for(current_db_file(), query, params)
+    if key is None:
+        return _execute_query(query, params)
+    versions = _versions_for(pool)
+    if not versions.available:
+        return _execute_query(query, params)
+    # versions are read before the query runs, so a write landing in between
+    # can only make the stored entry look older than it is
+    current = versions.current()
+    rows = query_cache.get(key, tables, current)
+    if rows is not None:
+        return rows
+    rows = _execute_query(query, params)
+    query_cache.put(key, tables, current, rows)
+    return rows
+
+def _execute_query(query, params=None, fetch=True):
+    pool = _active_pool.get()
+    if pool is not None:
+        conn = pool.acquire()
+    else:
+        conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT_SECONDS)
+        conn.row_factory = sqlite3.Row  
     cursor = conn.cursor()
     
     try:
@@ -125,18 +527,18 @@ def execute_query(query, params=None, fetch=True):
         if fetch:
             if query.strip().upper().startswith("SELECT"):
                
-                results = [dict(row) for row in cursor.fetchall()]
-                conn.close()
-                return results
+                return [dict(row) for row in cursor.fetchall()]
             else:
                 conn.commit()
-                last_id = cursor.lastrowid
-                conn.close()
-                return {"id": last_id}
+                return {"id": cursor.lastrowid}
         else:
             conn.commit()
-            conn.close()
             return {"success": True}
-    except Exception as e:
-        conn.close()
-        raise e 
\ No newline at end of file
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if pool is not None:
+            pool.release(conn)
+        else:
+            conn.close() 
\ No newline at end of file
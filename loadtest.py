@@ -0,0 +1,606 @@
+"""
+End-to-end load test for the WhatsApp webhook.
+
+Replays multi-turn booking conversations from a corpus against the FastAPI app
+in-process. Every simulated user gets its own From/WaId, the Gemini agents are
+replaced by stub agents that return the SQL/replies the real prompts ask for,
+and Twilio is replaced by a local fake client. Each simulated user runs in its
+own thread with its own event loop, so the blocking handler really overlaps
+the way it does under a threaded server, and latency is timed from the moment
+the user submits the message. A turn counts as failed when the webhook does
+not return 200, no reply reaches the user, the reply is an error message, or
+the app logged an error while handling it. Concurrency is ramped through the
+requested levels and a JSON report is written so runs can be compared across
+commits.
+
+Usage:
+    python loadtest.py --concurrency 1,2,4,8 --conversations 3 --output run.json
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+import database
+from model_router import ModelRouter
+
+
+DEFAULT_CORPUS = [
+    ["Hi", "I'd like a haircut", "John please", "Tomorrow at 4pm works", "CONFIRM"],
+    ["Hello there", "What services do you have?", "How much is a facial?", "EXIT"],
+    ["hey", "facial pls", "with emma", "tomorrow 11am", "CONFIRM"],
+    ["Hi!", "Can I get a massage?", "Who is your most experienced artist?", "Lisa then", "Friday 2pm", "CONFIRM"],
+    ["good morning", "haircolour", "Michael", "any slot after 5?", "EXIT"],
+]
+
+# replies the webhook sends instead of an answer when something went wrong
+ERROR_REPLY_PREFIXES = ("Sorry, I", "You are not subscribed")
+# pauses between retries of a locked statement, like SQLite's own busy handler
+BUSY_BACKOFF_SECONDS = (0.001, 0.002, 0.005, 0.01, 0.015, 0.02, 0.025)
+
+
+def load_corpus(path):
+    """
+    Load a conversation corpus.
+
+    Parameters:
+    path (str): JSONL file with one conversation (a JSON list of user turns) per line,
+                or None for the built-in corpus.
+
+    Returns:
+    list: List of conversations.
+    """
+    if not path:
+        return DEFAULT_CORPUS
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                corpus.append(json.loads(line))
+    return corpus
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    """Summary statistics (in milliseconds) for a list of durations in seconds"""
+    ms = [v * 1000.0 for v in values]
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "p50": round(percentile(ms, 50), 3),
+        "p95": round(percentile(ms, 95), 3),
+        "p99": round(percentile(ms, 99), 3),
+        "max": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+class FakeTwilioClient:
+    """Stand-in for twilio.rest.Client that records outbound messages"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []
+        self.lock = threading.Lock()
+        self.messages = SimpleNamespace(create=self._create)
+
+    def _create(self, from_=None, body=None, to=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.sent.append((to, body))
+            sid = f"SMFAKE{len(self.sent):010d}"
+        return SimpleNamespace(sid=sid, body=body, to=to)
+
+    def drain(self):
+        with self.lock:
+            sent, self.sent = self.sent, []
+        return sent
+
+    def drain_to(self, to):
+        """Remove and return the bodies sent to one recipient"""
+        with self.lock:
+            bodies = [body for recipient, body in self.sent if recipient == to]
+            self.sent = [item for item in self.sent if item[0] != to]
+        return bodies
+
+
+class _StubAgent:
+    def __init__(self, latency, cpu=0.0):
+        """
+        Parameters:
+        latency (float): Seconds each call blocks without using the CPU (like waiting on Gemini).
+        cpu (float): Seconds of GIL-holding Python work each call does on top of that.
+        """
+        self.latency = latency
+        self.cpu = cpu
+
+    def _think(self, share=1.0):
+        if self.latency:
+            time.sleep(self.latency * share)
+        if self.cpu:
+            deadline = time.perf_counter() + self.cpu * share
+            total = 0
+            while time.perf_counter() < deadline:
+                total += sum(i * i for i in range(200))
+
+
+class StubSQLAgent(_StubAgent):
+    def generate_query(self, phone_number):
+        self._think()
+        return f"SELECT id, name, phone, is_member FROM users WHERE phone = '{phone_number}' AND is_deleted = 0"
+
+
+class StubChatAgent(_StubAgent):
+    def check_active_chat(self, user_id):
+        self._think()
+        return (
+            f"SELECT id, user_id, status FROM chats WHERE user_id = {user_id} "
+            "AND status = 'active' ORDER BY created_at DESC LIMIT 1"
+        )
+
+    def create_new_chat(self, user_id):
+        self._think()
+        return (
+            "INSERT INTO chats (user_id, status, created_at, updated_at) "
+            f"VALUES ({user_id}, 'active', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"
+        )
+
+    def get_chat_messages(self, chat_id):
+        self._think()
+        return f"SELECT user_message, bot_reply FROM messages WHERE chat_id = {chat_id} ORDER BY created_at ASC"
+
+    def save_message(self, chat_id, user_id, user_message, bot_reply):
+        self._think()
+        user_message = user_message.replace("'", "''")
+        bot_reply = bot_reply.replace("'", "''")
+        return (
+            "INSERT INTO messages (chat_id, user_id, user_message, bot_reply, created_at) "
+            f"VALUES ({chat_id}, {user_id}, '{user_message}', '{bot_reply}', CURRENT_TIMESTAMP)"
+        )
+
+    def end_chat(self, chat_id):
+        self._think()
+        return f"UPDATE chats SET status = 'ended', updated_at = CURRENT_TIMESTAMP WHERE id = {chat_id}"
+
+
+class StubDataAgent(_StubAgent):
+    def get_all_products(self):
+        self._think()
+        return "SELECT id, name, price, duration FROM products"
+
+    def get_all_artists(self):
+        self._think()
+        return "SELECT id, name, experience, expertise FROM artists"
+
+    def get_all_appointments(self):
+        self._think()
+        return (
+            "SELECT a.id, a.artist_id, a.user_id, a.booking_time, a.product_id, a.status, ar.name AS artist_name "
+            "FROM appointments a JOIN artists ar ON a.artist_id = ar.id "
+            "WHERE DATE(a.booking_time) = DATE('now')"
+        )
+
+    def create_appointment(self, user_id, artist_id, product_id, booking_time):
+        self._think()
+        return (
+            "INSERT INTO appointments (user_id, artist_id, product_id, booking_time, status) "
+            f"VALUES ({user_id}, {artist_id}, {product_id}, '{booking_time}', 'booked')"
+        )
+
+
+class StubBookingAgent(_StubAgent):
+    def process_message(self, user_message, user_data, chat_history, products, artists, appointments, persona=None, hints=None):
+        self._think()
+        return self._reply(user_message, user_data)
+
+    def _reply(self, user_message, user_data):
+        text = user_message.strip().upper()
+        if text == "EXIT":
+            return "FALSE"
+        if text == "CONFIRM":
+            slot = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d 16:00:00")
+            return f"TRUE,1,1,{slot},John,Haircut"
+        return f"Happy to help, {user_data.get('name', 'there')}! Which service and artist would you like?"
+
+    def stream_message(self, user_message, user_data, chat_history, products, artists, appointments, persona=None, hints=None):
+        """The same reply word by word, with the simulated latency spread over the words"""
+        words = self._reply(user_message, user_data).split(" ")
+        for i, word in enumerate(words):
+            self._think(1.0 / len(words))
+            yield word if i == 0 else " " + word
+
+
+class StubFormattingAgent(_StubAgent):
+    def _format(self, rows, empty):
+        self._think()
+        if not rows:
+            return empty
+        return "\n".join(f"{i}. {row}" for i, row in enumerate(rows, 1))
+
+    def format_products(self, products_data):
+        return self._format(products_data, "No products available.")
+
+    def format_artists(self, artists_data):
+        return self._format(artists_data, "No artists available.")
+
+    def format_appointments(self, appointments_data):
+        return self._format(appointments_data, "No appointments scheduled for today.")
+
+
+class DBProbe:
+    """
+    Wraps execute_query to time statements and measure lock contention.
+
+    SQLite's busy handler waits for a lock inside sqlite3, where the wait is
+    invisible and only shows up as an error once the timeout runs out. The
+    probe takes that wait over: prepare_app opens the app's connections with
+    no busy timeout, and a statement failing with "database is locked" is
+    retried here (it was rolled back, so nothing ran twice) within the same
+    budget. The time from a statement's first attempt to the attempt that
+    got the lock is its lock wait.
+    """
+
+    def __init__(self, execute_query, busy_timeout=5.0):
+        self._execute_query = execute_query
+        self.busy_timeout = busy_timeout
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.read_times = []
+        self.write_times = []
+        self.lock_waits = []
+        self.locked_errors = 0
+
+    def __call__(self, query, params=None, fetch=True):
+        start = time.perf_counter()
+        attempt = 0
+        waited = 0.0
+        try:
+            while True:
+                try:
+                    return self._execute_query(query, params, fetch)
+                except sqlite3.OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+                    if time.perf_counter() - start >= self.busy_timeout:
+                        with self.lock:
+                            self.locked_errors += 1
+                        raise
+                time.sleep(BUSY_BACKOFF_SECONDS[min(attempt, len(BUSY_BACKOFF_SECONDS) - 1)])
+                attempt += 1
+                waited = time.perf_counter() - start
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                if query.strip().upper().startswith("SELECT"):
+                    self.read_times.append(elapsed)
+                else:
+                    self.write_times.append(elapsed)
+                if attempt:
+                    self.lock_waits.append(waited)
+
+    def report(self):
+        statements = len(self.read_times) + len(self.write_times)
+        return {
+            "reads": summarize(self.read_times),
+            "writes": summarize(self.write_times),
+            "lock_wait_ms": summarize(self.lock_waits),
+            "lock_wait_total_ms": round(sum(self.lock_waits) * 1000.0, 3),
+            "lock_wait_share": round(len(self.lock_waits) / statements, 4) if statements else 0.0,
+            "locked_errors": self.locked_errors,
+        }
+
+
+class ErrorLogCounter(logging.Handler):
+    """Counts ERROR records per thread, so each simulated user sees the errors its own turns logged"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.counts = {}
+
+    def emit(self, record):
+        # handle() already holds the handler's lock around emit()
+        self.counts[record.thread] = self.counts.get(record.thread, 0) + 1
+
+    def take(self):
+        """Errors logged by the calling thread since its last take()"""
+        with self.lock:
+            return self.counts.pop(threading.get_ident(), 0)
+
+
+def phone_for(index):
+    return f"+1555{index:07d}"
+
+
+def seed_users(count):
+    """Insert one member row per simulated user"""
+    conn = sqlite3.connect(database.DB_FILE)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (name, phone, email, is_member) VALUES (?, ?, ?, 1)",
+        [(f"Load User {i}", phone_for(i), f"load{i}@example.com") for i in range(count)],
+    )
+    conn.commit()
+    conn.close()
+
+
+_message_sids = itertools.count(1)
+
+
+def sign_form(url, form, auth_token=None):
+    """
+    Sign a webhook form the way Twilio does.
+
+    Adds a unique MessageSid (as every real webhook has, so identical texts
+    aren't taken for replays) and returns the form with its X-Twilio-Signature.
+    """
+    from twilio.request_validator import RequestValidator
+
+    form = dict(form)
+    form.setdefault("MessageSid", f"SM{os.getpid():08x}{next(_message_sids):024x}")
+    token = auth_token or os.getenv("TWILIO_AUTH_TOKEN", "loadtest")
+    return form, RequestValidator(token).compute_signature(url, form)
+
+
+def build_request(form):
+    """Build an ASGI scope/receive pair for a signed, urlencoded webhook POST"""
+    form, signature = sign_form("http://localhost/webhook/whatsapp", form)
+    body = urlencode(form).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/webhook/whatsapp",
+        "raw_path": b"/webhook/whatsapp",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-twilio-signature", signature.encode()),
+        ],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 40000),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    return scope, receive
+
+
+async def post_webhook(asgi_app, form):
+    """POST a form to the webhook and return the HTTP status code"""
+    scope, receive = build_request(form)
+    status = {}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await asgi_app(scope, receive, send)
+    return status.get("code", 0)
+
+
+def classify_turn(code, replies, logged_errors):
+    """Reason a turn failed ("http", "no_reply", "error_reply", "logged_error"), or None if it succeeded"""
+    if code != 200:
+        return "http"
+    if not replies:
+        return "no_reply"
+    if any(body and body.startswith(ERROR_REPLY_PREFIXES) for body in replies):
+        return "error_reply"
+    if logged_errors:
+        return "logged_error"
+    return None
+
+
+def simulated_user(asgi_app, index, conversations, think_time, twilio, error_log, results):
+    """
+    Replay conversations as one user, in the calling thread.
+
+    Each turn is timed from submission to the webhook's response and
+    appended to `results` as (seconds, failure reason or None).
+    """
+    phone = phone_for(index)
+    loop = asyncio.new_event_loop()
+    try:
+        for conversation in conversations:
+            for turn, text in enumerate(conversation):
+                form = {
+                    "From": f"whatsapp:{phone}",
+                    "To": "whatsapp:+14155238886",
+                    "WaId": phone.lstrip("+"),
+                    "Body": text,
+                    "MessageSid": f"SMLOAD{index:05d}{turn:03d}{int(time.time() * 1e6) % 10**9:09d}",
+                    "NumMedia": "0",
+                }
+                start = time.perf_counter()
+                try:
+                    code = loop.run_until_complete(post_webhook(asgi_app, form))
+                except Exception:
+                    code = 0
+                elapsed = time.perf_counter() - start
+                replies = twilio.drain_to(f"whatsapp:{phone}")
+                results.append((elapsed, classify_turn(code, replies, error_log.take())))
+                if think_time:
+                    time.sleep(think_time)
+    finally:
+        loop.close()
+
+
+def run_level(asgi_app, concurrency, corpus, conversations_per_user, think_time, twilio, error_log):
+    """Run one concurrency level with a thread per simulated user; returns (results, seconds)"""
+    results = []
+    users = []
+    for index in range(concurrency):
+        picked = [corpus[(index + n) % len(corpus)] for n in range(conversations_per_user)]
+        users.append(threading.Thread(
+            target=simulated_user,
+            args=(asgi_app, index, picked, think_time, twilio, error_log, results),
+            name=f"loadtest-user-{index}",
+        ))
+    start = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    return results, time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def install_stubs(app_module, model_latency=0.0, twilio_latency=0.0, model_cpu=0.0):
+    """Swap the app's agents and Twilio client for the local stand-ins"""
+    app_module.sql_agent = StubSQLAgent(model_latency, model_cpu)
+    app_module.chat_agent = StubChatAgent(model_latency, model_cpu)
+    app_module.data_agent = StubDataAgent(model_latency, model_cpu)
+    app_module.booking_router = ModelRouter.from_env(
+        backend_factory=lambda profile: StubBookingAgent(model_latency, model_cpu)
+    )
+    app_module.formatting_agent = StubFormattingAgent(model_latency, model_cpu)
+    app_module.twilio_client = FakeTwilioClient(twilio_latency)
+
+
+def install_stubs_from_env(app_module):
+    """
+    Worker hook for cluster.py: stubs configured from LOADTEST_MODEL_LATENCY_MS,
+    LOADTEST_TWILIO_LATENCY_MS and LOADTEST_MODEL_CPU_MS
+    """
+    install_stubs(
+        app_module,
+        float(os.getenv("LOADTEST_MODEL_LATENCY_MS", "0")) / 1000.0,
+        float(os.getenv("LOADTEST_TWILIO_LATENCY_MS", "0")) / 1000.0,
+        float(os.getenv("LOADTEST_MODEL_CPU_MS", "0")) / 1000.0,
+    )
+
+
+def prepare_app(db_file, model_latency, twilio_latency):
+    """Import the app against a scratch database with stub agents and a fake Twilio client"""
+    os.environ.setdefault("GOOGLE_API_KEY", "loadtest")
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "AC" + "0" * 32)
+    os.environ.setdefault("TWILIO_AUTH_TOKEN", "loadtest")
+    database.DB_FILE = db_file
+
+    import app as app_module
+
+    database.init_db()
+    install_stubs(app_module, model_latency, twilio_latency)
+    # the probe does the busy waiting itself so the time spent on locks is measured
+    probe = DBProbe(database.execute_query, database.BUSY_TIMEOUT_SECONDS)
+    database.BUSY_TIMEOUT_SECONDS = 0
+    app_module.execute_query = probe
+    return app_module, probe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the WhatsApp webhook")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma separated concurrency levels to ramp through")
+    parser.add_argument("--conversations", type=int, default=2, help="Conversations replayed per simulated user")
+    parser.add_argument("--corpus", help="JSONL corpus, one JSON list of user turns per line")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="Simulated latency per stub agent call")
+    parser.add_argument("--twilio-latency-ms", type=float, default=0.0, help="Simulated latency per outbound send")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between turns of a simulated user")
+    parser.add_argument("--db", help="Database file to use (defaults to a fresh temporary file)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    corpus = load_corpus(args.corpus)
+
+    tmpdir = None
+    db_file = args.db
+    if not db_file:
+        tmpdir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(tmpdir.name, "loadtest.db")
+
+    app_module, probe = prepare_app(db_file, args.model_latency_ms / 1000.0, args.twilio_latency_ms / 1000.0)
+    seed_users(max(levels))
+    error_log = ErrorLogCounter()
+    logging.getLogger().addHandler(error_log)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "corpus_conversations": len(corpus),
+            "conversations_per_user": args.conversations,
+            "model_latency_ms": args.model_latency_ms,
+            "twilio_latency_ms": args.twilio_latency_ms,
+            "think_ms": args.think_ms,
+        },
+        "levels": [],
+    }
+
+    for concurrency in levels:
+        probe.reset()
+        app_module.twilio_client.drain()
+        # keep the app's own prints out of the JSON report on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            results, duration = run_level(
+                app_module.app, concurrency, corpus, args.conversations, args.think_ms / 1000.0,
+                app_module.twilio_client, error_log,
+            )
+        failures = [reason for _, reason in results if reason]
+        report["levels"].append({
+            "concurrency": concurrency,
+            "requests": len(results),
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(results) / duration, 3) if duration else 0.0,
+            "latency_ms": summarize([elapsed for elapsed, _ in results]),
+            "errors": {reason: failures.count(reason) for reason in ("http", "no_reply", "error_reply", "logged_error")},
+            "error_rate": round(len(failures) / len(results), 4) if results else 0.0,
+            "db": probe.report(),
+        })
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if tmpdir:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Non-blocking structured logging.
+
+Request handlers only enqueue log records; a background QueueListener thread
+formats them as JSON lines, truncating large payloads, and writes them out.
+DEBUG records are sampled per stage so hot paths don't flood the output, and
+per-module levels can be changed at runtime.
+
+Environment:
+    LOG_LEVEL               root level (default INFO)
+    LOG_LEVELS              per-module overrides, e.g. "database=WARNING,app=DEBUG"
+    LOG_FILE                write to this file instead of stderr
+    LOG_MAX_FIELD_CHARS     truncate messages/fields longer than this (default 1000)
+    LOG_DEBUG_SAMPLE_EVERY  keep one in N DEBUG records per stage (default 10)
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+# attributes every LogRecord has; anything else came in through `extra=`
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# argument types that cannot change between the log call and the listener formatting them
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+_listener = None
+
+
+def mask_phone(number):
+    """'whatsapp:+15551234567' -> 'whatsapp:********4567', for logs above DEBUG"""
+    number = number or ""
+    prefix, _, digits = number.rpartition(":")
+    prefix = f"{prefix}:" if prefix else ""
+    return prefix + "*" * max(0, len(digits) - 4) + digits[-4:]
+
+
+def truncate(value, limit):
+    text = value if isinstance(value, str) else str(value)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...[truncated {len(text) - limit} chars]"
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with every field truncated to max_chars"""
+
+    def __init__(self, max_chars=1000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        try:
+            message = record.getMessage()
+        except Exception as e:
+            message = f"{record.msg!r} (bad log arguments: {e})"
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(message, self.max_chars),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else truncate(value, self.max_chars)
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), self.max_chars * 4)
+        elif record.exc_text:
+            entry["exc"] = truncate(record.exc_text, self.max_chars * 4)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keep one in `every` DEBUG records per stage. The stage is the `stage` extra
+    when given, otherwise logger name plus calling function.
+    """
+
+    def __init__(self, every=10):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or self.every == 1:
+            return True
+        stage = getattr(record, "stage", None) or f"{record.name}.{record.funcName}"
+        with self._lock:
+            count = self._counts.get(stage, 0)
+            self._counts[stage] = count + 1
+        return count % self.every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler formats every record in the caller's thread; here the
+    record is shallow-copied so the request path only pays for the enqueue.
+    The copy shares its arguments with the caller, so a record whose arguments
+    (or extras) are mutable, such as the rows or chat history a handler goes on
+    to change, is formatted now; records with only scalar arguments, the usual
+    case, stay deferred.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        args = record.args
+        values = args.values() if isinstance(args, dict) else (args or ())
+        if not all(isinstance(value, _IMMUTABLE) for value in values):
+            try:
+                record.msg, record.args = record.getMessage(), None
+            except Exception:
+                # left for JsonFormatter to report as bad log arguments
+                pass
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_") and not isinstance(value, _IMMUTABLE):
+                setattr(record, key, str(value))
+        if record.exc_info:
+            # tracebacks reference live frames, render them now
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec):
+    """Parse "module=LEVEL,other=LEVEL" into a dict"""
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def set_level(name, level):
+    """Change the level of one logger ("root" or "" for the root logger) at runtime"""
+    logger = logging.getLogger(None if name in ("", "root") else name)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    return logging.getLevelName(logger.level)
+
+
+def get_levels():
+    """Levels of the root logger and every logger with an explicit level"""
+    levels = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+def setup_logging():
+    """Route all logging through a queue to a background JSON writer (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    log_file = os.getenv("LOG_FILE")
+    if log_file:
+        target = logging.handlers.WatchedFileHandler(log_file, encoding="utf-8")
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(JsonFormatter(int(os.getenv("LOG_MAX_FIELD_CHARS", "1000"))))
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(DebugSampler(int(os.getenv("LOG_DEBUG_SAMPLE_EVERY", "10"))))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name, level in parse_levels(os.getenv("LOG_LEVELS")).items():
+        set_level(name, level)
+
+    _listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
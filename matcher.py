@@ -0,0 +1,230 @@
+"""
+Local fuzzy matcher for service and artist selection.
+
+Builds a trigram index over products.name and artists.name/expertise, then
+resolves free text like "facial pls", "haircolour" or "with emma" to catalog
+entries: candidate phrases of the message (1-3 word windows, also with the
+spaces removed) pull aliases sharing trigrams from the index, and the best
+candidates are scored by normalized edit distance. Matches above the
+confidence threshold are handed to the BookingAgent as hints.
+
+Matchers are cached by a fingerprint of the catalog rows, so one is rebuilt
+only when products or artists actually change.
+"""
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+STOPWORDS = {
+    "a", "an", "the", "i", "id", "im", "me", "my", "to", "for", "with", "and", "or", "please", "pls", "plz",
+    "want", "wanna", "like", "would", "get", "book", "can", "could", "do", "you", "have", "some", "any",
+    "at", "on", "in", "by", "is", "it", "of", "hi", "hey", "hello", "thanks", "thank", "ok", "okay", "yes",
+    "no", "then", "also", "just", "one", "session", "appointment", "today", "tomorrow",
+}
+
+# just under a name match, so "emma" beats someone's expertise on a tie, while
+# an exact expertise phrase ("skin care") still clears the default threshold
+ARTIST_EXPERTISE_WEIGHT = 0.95
+
+
+def _stem(token):
+    # cheap normalisation so "colour"/"coloring"/"colors" meet at "color"
+    if token.endswith("our") and len(token) > 4:
+        token = token[:-3] + "or"
+    if token.endswith("ing") and len(token) > 5:
+        token = token[:-3]
+    if token.endswith("s") and not token.endswith("ss") and len(token) > 3:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [_stem(token) for token in re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))]
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """1 - edit distance / max(len(a), len(b)), counting an adjacent swap ("facail") as one edit"""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    if len(a) < len(b):
+        a, b = b, a
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        before, previous = previous, current
+    return 1.0 - previous[-1] / len(a)
+
+
+class Match:
+    __slots__ = ("kind", "id", "name", "score", "phrase", "source")
+
+    def __init__(self, kind, entity_id, name, score, phrase, source="name"):
+        self.kind = kind
+        self.id = entity_id
+        self.name = name
+        self.score = score
+        self.phrase = phrase
+        self.source = source
+
+    def __repr__(self):
+        return f"Match({self.kind}={self.name!r} id={self.id} score={self.score:.2f} from {self.phrase!r})"
+
+
+class CatalogMatcher:
+    def __init__(self, products, artists, max_candidates=8):
+        """
+        Parameters:
+        products (list): Rows with id and name.
+        artists (list): Rows with id, name and expertise.
+        max_candidates (int): Aliases re-scored by edit distance per phrase.
+        """
+        self.max_candidates = max_candidates
+        # alias entries: (kind, entity id, display name, normalized alias, weight, trigram count, source)
+        self.aliases = []
+        # rows come from agent-generated queries, so columns are looked up defensively
+        for product in products or []:
+            if product.get("name"):
+                self._add("product", product.get("id"), product["name"], product["name"], 1.0, "name")
+        for artist in artists or []:
+            if not artist.get("name"):
+                continue
+            self._add("artist", artist.get("id"), artist["name"], artist["name"], 1.0, "name")
+            if artist.get("expertise"):
+                self._add("artist", artist.get("id"), artist["name"], artist["expertise"], ARTIST_EXPERTISE_WEIGHT,
+                          "expertise")
+        self.index = defaultdict(list)
+        for alias_id, alias in enumerate(self.aliases):
+            for gram in trigrams(alias[3]):
+                self.index[gram].append(alias_id)
+
+    def _add(self, kind, entity_id, name, text, weight, source):
+        tokens = tokenize(text)
+        if not tokens:
+            return
+        for alias in {" ".join(tokens), "".join(tokens)}:
+            self.aliases.append((kind, entity_id, name, alias, weight, len(trigrams(alias)), source))
+
+    def _phrases(self, text):
+        tokens = tokenize(text)
+        for size in (3, 2, 1):
+            for start in range(len(tokens) - size + 1):
+                window = tokens[start:start + size]
+                # a catalog name never starts or ends with filler words
+                if window[0] in STOPWORDS or window[-1] in STOPWORDS:
+                    continue
+                yield " ".join(window)
+                if size > 1:
+                    yield "".join(window)
+
+    def match(self, text, threshold=0.8):
+        """
+        Best product and artist match for a message.
+
+        Returns:
+        dict: {"product": Match or None, "artist": Match or None}
+        """
+        # artists matched by name and by expertise are kept apart; a name wins
+        best = {"product": None, "artist": None, "expertise": None}
+        seen = set()
+        for phrase in self._phrases(text):
+            if phrase in seen or len(phrase) < 3:
+                continue
+            seen.add(phrase)
+            grams = trigrams(phrase)
+            counts = defaultdict(int)
+            for gram in grams:
+                for alias_id in self.index.get(gram, ()):
+                    counts[alias_id] += 1
+            if not counts:
+                continue
+            candidates = sorted(counts, key=counts.get, reverse=True)[:self.max_candidates]
+            for alias_id in candidates:
+                kind, entity_id, name, alias, weight, gram_count, source = self.aliases[alias_id]
+                # cheap bounds first: trigram overlap, then the length difference,
+                # which alone costs that many edits
+                if 2.0 * counts[alias_id] / (len(grams) + gram_count) < 0.3:
+                    continue
+                longest = max(len(phrase), len(alias))
+                if (1.0 - abs(len(phrase) - len(alias)) / longest) * weight < threshold:
+                    continue
+                slot = "expertise" if source == "expertise" else kind
+                current = best[slot]
+                if current is not None and weight <= current.score:
+                    continue
+                score = similarity(phrase, alias) * weight
+                if score >= threshold and (current is None or score > current.score):
+                    best[slot] = Match(kind, entity_id, name, score, phrase, source)
+        expertise, product = best.pop("expertise"), best["product"]
+        # "haircolour" names the service; that it is also Michael's expertise
+        # doesn't mean the user asked for Michael
+        if (best["artist"] is None and expertise is not None
+                and not (product is not None and expertise.phrase.replace(" ", "") in product.phrase.replace(" ", ""))):
+            best["artist"] = expertise
+        return best
+
+
+def catalog_fingerprint(products, artists):
+    return hash((
+        tuple((p.get("id"), p.get("name")) for p in products or []),
+        tuple((a.get("id"), a.get("name"), a.get("expertise")) for a in artists or []),
+    ))
+
+
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+MAX_CACHED_MATCHERS = 256
+
+
+def catalog_rows(value):
+    """
+    Catalog rows as a list of dicts. The rows come from agent-generated SQL,
+    which can hand back a single dict, False on error, or None.
+    """
+    if isinstance(value, dict):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [row for row in value if isinstance(row, dict)]
+    return []
+
+
+def get_matcher(products, artists):
+    """Matcher for this catalog, rebuilt only when the catalog rows change"""
+    products, artists = catalog_rows(products), catalog_rows(artists)
+    key = catalog_fingerprint(products, artists)
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is not None:
+            _matchers.move_to_end(key)
+            return matcher
+    matcher = CatalogMatcher(products, artists)
+    with _matchers_lock:
+        _matchers[key] = matcher
+        while len(_matchers) > MAX_CACHED_MATCHERS:
+            _matchers.popitem(last=False)
+    return matcher
+
+
+def selection_hints(text, products, artists, threshold=0.8):
+    """Prompt hint describing confidently matched selections, or None"""
+    matches = get_matcher(products, artists).match(text, threshold)
+    parts = []
+    if matches["product"]:
+        parts.append(f"service '{matches['product'].name}' (product_id {matches['product'].id})")
+    if matches["artist"]:
+        parts.append(f"artist '{matches['artist'].name}' (artist_id {matches['artist'].id})")
+    if not parts:
+        return None
+    return "The user's latest message most likely refers to " + " and ".join(parts) + "."
@@ -0,0 +1,353 @@
+"""
+Model tiering for the booking agent.
+
+Each turn is classified locally (message length, detected intent and booking
+stage) and handed to the BookingAgent built for one of several model
+profiles, e.g. a small model for "thanks!" and a stronger one for a
+multi-constraint rescheduling request. A profile that errors or returns
+nothing falls back to the next tier up. Per-tier latency, estimated cost and
+fallback counts are kept for /admin/model-tiers and /metrics.
+
+Profiles come from MODEL_PROFILES_FILE (JSON list, format as DEFAULT_PROFILES)
+or the defaults below. Routing is off unless MODEL_TIERING=1; until then
+every turn goes to a single "standard" profile that sets no model,
+temperature or output length, so the booking agent runs on phi's default
+Gemini model with its defaults, exactly as before tiering existed.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from tracing import model_tier_calls_total, model_tier_seconds, model_tier_cost_total, token_usage
+
+logger = logging.getLogger(__name__)
+
+MODEL_TIERING = os.getenv("MODEL_TIERING", "false").lower() in ("1", "true", "yes")
+DEFAULT_TIER = "standard"
+
+# prices are USD per million tokens; lite's output cap is the same as standard's
+# because it answers opening and selection turns, which list services, artists
+# and slots (output is billed per token produced, not per token allowed)
+DEFAULT_PROFILES = [
+    {"name": "lite", "model": "gemini-1.5-flash-8b", "temperature": 0.3, "max_output_tokens": 1024,
+     "input_cost": 0.0375, "output_cost": 0.15},
+    {"name": "standard", "model": "gemini-1.5-flash", "temperature": 0.7, "max_output_tokens": 1024,
+     "input_cost": 0.075, "output_cost": 0.30},
+    {"name": "advanced", "model": "gemini-1.5-pro", "temperature": 0.4, "max_output_tokens": 2048,
+     "input_cost": 1.25, "output_cost": 5.00},
+]
+
+SMALLTALK = {
+    "hi", "hello", "hey", "thanks", "thank", "you", "thx", "ty", "ok", "okay", "cool", "great", "bye",
+    "yes", "no", "sure", "perfect", "nice", "good", "morning", "evening", "cheers", "awesome",
+    # farewells and acknowledgements ("see you later", "ok both work")
+    "see", "later", "talk", "soon", "goodbye", "cya", "night", "then", "that", "it", "all", "both",
+    "work", "works", "fine", "sounds",
+}
+# explicit intent to move or drop a booking escalates on its own
+RESCHEDULE_KEYWORDS = {"reschedule", "rebook", "cancel", "move", "swap", "postpone"}
+# words that only make a turn hard when it is also about a booking
+QUALIFIER_KEYWORDS = {
+    "change", "instead", "earlier", "later", "both", "unless", "except", "another", "either",
+    "multiple", "friend", "friends", "group",
+}
+DAY_WORDS = {
+    "today", "tonight", "tomorrow", "weekend", "week", "monday", "tuesday", "wednesday", "thursday",
+    "friday", "saturday", "sunday",
+}
+# two or more clock times in one message usually means alternatives or a move
+CLOCK_TIME = re.compile(r"\b\d{1,2}(?::\d{2})?\s*(?:am|pm)\b|\b\d{1,2}:\d{2}\b", re.IGNORECASE)
+LONG_MESSAGE_CHARS = 160
+
+
+class ModelProfile:
+    def __init__(self, name, model=None, temperature=0.7, max_output_tokens=1024, input_cost=0.0, output_cost=0.0):
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.max_output_tokens = max_output_tokens
+        self.input_cost = input_cost
+        self.output_cost = output_cost
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=data["name"],
+            model=data.get("model"),
+            temperature=data.get("temperature", 0.7),
+            max_output_tokens=data.get("max_output_tokens", 1024),
+            input_cost=data.get("input_cost", 0.0),
+            output_cost=data.get("output_cost", 0.0),
+        )
+
+    def generation_config(self):
+        """Settings passed to the model, or None to keep all of its defaults"""
+        config = {"temperature": self.temperature, "max_output_tokens": self.max_output_tokens}
+        return {key: value for key, value in config.items() if value is not None} or None
+
+    def cost(self, input_tokens, output_tokens):
+        return (input_tokens * self.input_cost + output_tokens * self.output_cost) / 1_000_000
+
+    def __repr__(self):
+        return f"<ModelProfile {self.name} {self.model} t={self.temperature} max={self.max_output_tokens}>"
+
+
+def classify_turn(message, chat_history=None, hints=None):
+    """
+    Pick a tier for one turn from cheap local signals.
+
+    Returns:
+    tuple: (tier name, reason)
+    """
+    text = (message or "").strip()
+    upper = text.upper()
+    if upper == "EXIT":
+        return "lite", "exit"
+    if upper == "CONFIRM":
+        # has to pull exact ids and the agreed time out of the conversation
+        return "standard", "confirm"
+    words = re.findall(r"[a-z']+", text.lower())
+    if words and len(words) <= 6 and all(word in SMALLTALK for word in words):
+        # checked first: "see you later" or "ok both work" is not a rescheduling request
+        return "lite", "smalltalk"
+    times = CLOCK_TIME.findall(text)
+    booking_signal = bool(times or hints or DAY_WORDS.intersection(words))
+    if (len(text) > LONG_MESSAGE_CHARS
+            or RESCHEDULE_KEYWORDS.intersection(words)
+            or len(times) >= 2
+            or (booking_signal and QUALIFIER_KEYWORDS.intersection(words))):
+        return "advanced", "complex"
+    if hints and len(words) <= 6:
+        # the local matcher already resolved what the user picked
+        return "lite", "selection"
+    if not chat_history and len(words) <= 6:
+        return "lite", "opening"
+    return DEFAULT_TIER, "booking"
+
+
+def single_tier(message, chat_history=None, hints=None):
+    """Policy used when tiering is off: every turn on the standard profile"""
+    return DEFAULT_TIER, "untiered"
+
+
+def estimate_tokens(*parts):
+    # ~4 characters per token, for backends that don't report usage
+    return sum(len(str(part)) for part in parts if part) // 4
+
+
+class TierStats:
+    __slots__ = ("calls", "errors", "fallbacks", "seconds", "max_seconds", "cost", "input_tokens", "output_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.cost = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "fallback_rate": round(self.fallbacks / self.calls, 4) if self.calls else None,
+            "mean_ms": round(self.seconds / self.calls * 1000.0, 2) if self.calls else None,
+            "max_ms": round(self.max_seconds * 1000.0, 2),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+def default_backend(profile):
+    from Agents import BookingAgent
+
+    return BookingAgent(profile)
+
+
+class ModelRouter:
+    """Drop-in for BookingAgent.process_message that picks a model profile per turn"""
+
+    def __init__(self, profiles, backend_factory=default_backend, policy=classify_turn):
+        """
+        Parameters:
+        profiles (list): ModelProfile entries, cheapest first; fallbacks go up this list.
+        backend_factory (callable): profile -> object with BookingAgent's process_message.
+        policy (callable): (message, chat_history, hints) -> (tier name, reason).
+        """
+        self.profiles = list(profiles)
+        self._by_name = {profile.name: profile for profile in self.profiles}
+        self.backend_factory = backend_factory
+        self.policy = policy
+        self._backends = {}
+        self._lock = threading.Lock()
+        self._stats = {profile.name: TierStats() for profile in self.profiles}
+        self.reasons = {}
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        path = os.getenv("MODEL_PROFILES_FILE")
+        if path:
+            with open(path, encoding="utf-8") as f:
+                profiles = [ModelProfile.from_dict(item) for item in json.load(f)]
+        elif MODEL_TIERING:
+            profiles = [ModelProfile.from_dict(item) for item in DEFAULT_PROFILES]
+        else:
+            # untiered: no model, generation settings or fallback tiers, so replies
+            # are what they were before routing (standard's prices for the estimates)
+            standard = next(item for item in DEFAULT_PROFILES if item["name"] == DEFAULT_TIER)
+            profiles = [ModelProfile.from_dict(dict(standard, model=None, temperature=None, max_output_tokens=None))]
+        kwargs.setdefault("policy", classify_turn if MODEL_TIERING else single_tier)
+        return cls(profiles, **kwargs)
+
+    def backend(self, profile):
+        backend = self._backends.get(profile.name)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.get(profile.name)
+                if backend is None:
+                    backend = self._backends[profile.name] = self.backend_factory(profile)
+        return backend
+
+    def warm_up(self):
+        """Build the backend of every tier the policy can pick"""
+        for profile in self.profiles:
+            self.backend(profile)
+
+    def _resolve(self, tier):
+        if tier in self._by_name:
+            return self.profiles.index(self._by_name[tier])
+        if DEFAULT_TIER in self._by_name:
+            return self.profiles.index(self._by_name[DEFAULT_TIER])
+        return 0
+
+    def _route(self, user_message, chat_history, hints):
+        tier, reason = self.policy(user_message, chat_history, hints)
+        with self._lock:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return self._resolve(tier)
+
+    def _record(self, index, elapsed, usage, inputs, reply, error):
+        """Account one backend call; True if the reply is usable"""
+        profile = self.profiles[index]
+        stats = self._stats[profile.name]
+        input_tokens, output_tokens = usage
+        if not input_tokens:
+            input_tokens = estimate_tokens(*inputs)
+        if not output_tokens:
+            output_tokens = estimate_tokens(reply)
+        cost = profile.cost(input_tokens, output_tokens)
+        ok = error is None and bool(reply and reply.strip())
+        can_fall_back = index + 1 < len(self.profiles)
+        with self._lock:
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            stats.input_tokens += input_tokens
+            stats.output_tokens += output_tokens
+            stats.cost += cost
+            if error is not None:
+                stats.errors += 1
+            if not ok and can_fall_back:
+                stats.fallbacks += 1
+        model_tier_seconds.observe(elapsed, tier=profile.name)
+        model_tier_cost_total.inc(cost, tier=profile.name)
+        if ok:
+            model_tier_calls_total.inc(tier=profile.name, outcome="ok")
+            return True
+        model_tier_calls_total.inc(tier=profile.name, outcome="error" if error is not None else "empty")
+        if error is not None:
+            logger.warning("Model tier %s failed (%s)", profile.name, error)
+        else:
+            logger.warning("Model tier %s returned an empty reply", profile.name)
+        if can_fall_back:
+            model_tier_calls_total.inc(tier=profile.name, outcome="fallback")
+        return False
+
+    def process_message(self, user_message, user_data, chat_history, products, artists, appointments,
+                        persona=None, hints=None):
+        inputs = (user_message, chat_history, products, artists, appointments)
+        last_error = reply = None
+        for index in range(self._route(user_message, chat_history, hints), len(self.profiles)):
+            start = time.perf_counter()
+            error = None
+            with token_usage() as usage:
+                try:
+                    reply = self.backend(self.profiles[index]).process_message(
+                        user_message, user_data, chat_history, products, artists, appointments,
+                        persona=persona, hints=hints,
+                    )
+                except Exception as e:
+                    error, reply = e, None
+            if self._record(index, time.perf_counter() - start, usage, inputs, reply, error):
+                return reply
+            last_error = error or last_error
+        if last_error is not None:
+            raise last_error
+        return reply
+
+    def stream_message(self, user_message, user_data, chat_history, products, artists, appointments,
+                       persona=None, hints=None):
+        """
+        Like process_message, but yields the reply in pieces as the model produces them.
+
+        A tier that fails before producing anything falls back as usual; once
+        text has been yielded there is no going back, so later errors are raised.
+        Backends without stream_message yield their whole reply at once. Tier
+        latency leaves out the time the caller holds each piece.
+        """
+        inputs = (user_message, chat_history, products, artists, appointments)
+        last_error = None
+        for index in range(self._route(user_message, chat_history, hints), len(self.profiles)):
+            backend = self.backend(self.profiles[index])
+            start = time.perf_counter()
+            held = 0.0
+            pieces = []
+            error = None
+            try:
+                if hasattr(backend, "stream_message"):
+                    source = backend.stream_message(
+                        user_message, user_data, chat_history, products, artists, appointments,
+                        persona=persona, hints=hints,
+                    )
+                else:
+                    source = iter([backend.process_message(
+                        user_message, user_data, chat_history, products, artists, appointments,
+                        persona=persona, hints=hints,
+                    )])
+                for piece in source:
+                    if piece:
+                        pieces.append(piece)
+                        suspended = time.perf_counter()
+                        yield piece
+                        held += time.perf_counter() - suspended
+            except Exception as e:
+                if pieces:
+                    self._record(index, time.perf_counter() - start - held, (0, 0), inputs, None, e)
+                    raise
+                error = e
+            if self._record(index, time.perf_counter() - start - held, (0, 0), inputs, "".join(pieces), error):
+                return
+            last_error = error or last_error
+        if last_error is not None:
+            raise last_error
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tiering": self.policy is not single_tier,
+                "profiles": {
+                    profile.name: dict(self._stats[profile.name].as_dict(), model=profile.model)
+                    for profile in self.profiles
+                },
+                "reasons": dict(self.reasons),
+            }
+
+
+booking_router = ModelRouter.from_env()
@@ -0,0 +1,182 @@
+"""
+On-demand sampling profiler for live webhook requests.
+
+Profiling is off by default and costs a single attribute check per request.
+When switched on (admin endpoint or SIGUSR1) a sampled fraction of webhook
+requests runs under cProfile; a single request can also be forced with the
+X-BeauBot-Profile header. Samples are merged and periodically written as
+.pstats files (readable by snakeviz, flameprof, gprof2dot, ...) into a
+rotating directory.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-BeauBot-Profile"
+
+
+class RequestProfiler:
+    def __init__(self, output_dir="profiles", sample_rate=0.01, flush_every=50, max_files=20, token=None):
+        """
+        Parameters:
+        output_dir (str): Directory the .pstats files are written to.
+        sample_rate (float): Fraction of requests profiled while enabled.
+        flush_every (int): Number of profiled requests merged into one file.
+        max_files (int): Number of profile files kept before the oldest are removed.
+        token (str): Value of the force-profile header that enables profiling for one request.
+        """
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.flush_every = flush_every
+        self.max_files = max_files
+        self.token = token
+        self.enabled = False
+        self.profiled_requests = 0
+        self.files_written = 0
+        self._stats = None
+        self._pending = 0
+        self._active = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._toggle_requested = threading.Event()
+        self._signal_thread = None
+
+    def enable(self, sample_rate=None):
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.enabled = True
+        logger.info("Request profiling enabled at sample rate %s", self.sample_rate)
+
+    def disable(self):
+        self.enabled = False
+        self.flush()
+        logger.info("Request profiling disabled")
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def should_profile(self, request):
+        """Decide whether this request runs under the profiler"""
+        if self.token and request.headers.get(PROFILE_HEADER) == self.token:
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self):
+        """
+        Profile the enclosed block. Only one request is profiled at a time since
+        cProfile hooks the whole thread; overlapping requests run unprofiled.
+        """
+        if not self._active.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            self._collect(profiler)
+        finally:
+            self._active.release()
+
+    def _collect(self, profiler):
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+            self._pending += 1
+            self.profiled_requests += 1
+            should_flush = self._pending >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write the merged samples to a new .pstats file and rotate old ones"""
+        with self._stats_lock:
+            stats, pending = self._stats, self._pending
+            self._stats, self._pending = None, 0
+        if stats is None:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.files_written += 1
+        path = os.path.join(
+            self.output_dir,
+            f"webhook-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.files_written:04d}.pstats",
+        )
+        stats.dump_stats(path)
+        logger.info("Wrote profile of %s requests to %s", pending, path)
+        self._rotate()
+        return path
+
+    def _rotate(self):
+        files = sorted(
+            (os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir) if name.endswith(".pstats")),
+            key=os.path.getmtime,
+        )
+        for path in files[:-self.max_files] if self.max_files else []:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Could not remove old profile %s: %s", path, e)
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "profiled_requests": self.profiled_requests,
+            "pending_requests": self._pending,
+            "files_written": self.files_written,
+            "output_dir": self.output_dir,
+        }
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGUSR1", None)):
+        """
+        Toggle profiling on a POSIX signal (SIGUSR1 by default).
+
+        The handler runs on the main thread between any two bytecodes, possibly
+        while that thread holds _stats_lock inside flush(), so it only sets an
+        event; a background thread does the toggle, flush and file I/O.
+        """
+        if signum is None:
+            return False
+        try:
+            signal.signal(signum, lambda *_: self._toggle_requested.set())
+        except ValueError:
+            # signal handlers can only be installed from the main thread
+            logger.warning("Profiler signal handler not installed: not running in the main thread")
+            return False
+        if self._signal_thread is None:
+            self._signal_thread = threading.Thread(target=self._watch_signal, name="profiler-signal", daemon=True)
+            self._signal_thread.start()
+        return True
+
+    def _watch_signal(self):
+        while True:
+            self._toggle_requested.wait()
+            self._toggle_requested.clear()
+            try:
+                self.toggle()
+            except Exception as e:
+                logger.error("Could not toggle profiling: %s", e, exc_info=True)
+
+
+request_profiler = RequestProfiler(
+    output_dir=os.getenv("PROFILE_DIR", "profiles"),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.01")),
+    flush_every=int(os.getenv("PROFILE_FLUSH_EVERY", "50")),
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "20")),
+    token=os.getenv("ADMIN_TOKEN"),
+)
@@ -0,0 +1,178 @@
+"""
+Perceived-latency reduction: early acknowledgements and streamed replies.
+
+LatencyPredictor keeps an exponentially weighted moving average of every
+pipeline stage (fed by tracing spans). Once a member has been identified, the
+webhook asks it how long the rest of the turn will take; if that plus the
+time already spent passes ACK_THRESHOLD_SECONDS, a short acknowledgement is
+sent straight away so the user knows the message arrived.
+
+With STREAM_REPLIES on, the booking agent's output is streamed and sent as
+it arrives, cut at sentence boundaries into messages of at most
+MAX_MESSAGE_CHARS (Twilio's WhatsApp body limit). Chunks are sent one at a
+time, each only after Twilio has accepted the previous one, so they go out
+in order. The start of the reply is held back until it's clear it isn't a
+TRUE/FALSE control reply, which must never reach the user.
+"""
+import os
+import re
+import threading
+
+from tracing import add_stage_listener
+
+ACK_ENABLED = os.getenv("ACK_SLOW_TURNS", "false").lower() in ("1", "true", "yes")
+ACK_THRESHOLD_SECONDS = float(os.getenv("ACK_THRESHOLD_SECONDS", "4"))
+ACK_MESSAGE = os.getenv("ACK_MESSAGE", "Got it! Give me a moment while I check that for you ⏳")
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() in ("1", "true", "yes")
+
+MAX_MESSAGE_CHARS = 1600
+MIN_CHUNK_CHARS = int(os.getenv("STREAM_MIN_CHUNK_CHARS", "160"))
+CONTROL_PREFIXES = ("TRUE", "FALSE")
+CONTROL_PREFIX_CHARS = max(len(prefix) for prefix in CONTROL_PREFIXES)
+
+# stages still ahead once the member lookup is done
+REMAINING_STAGES = ("chat_lookup", "catalog", "match", "booking_agent", "save_message", "twilio_send")
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+
+
+class LatencyPredictor:
+    def __init__(self, alpha=0.2):
+        """
+        Parameters:
+        alpha (float): Weight of the newest observation in each stage's moving average.
+        """
+        self.alpha = alpha
+        self._estimates = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            previous = self._estimates.get(stage)
+            self._estimates[stage] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def predict(self, stages):
+        """Expected seconds for `stages`, or None until the slowest of them has been seen"""
+        with self._lock:
+            if "booking_agent" in stages and "booking_agent" not in self._estimates:
+                return None
+            return sum(self._estimates.get(stage, 0.0) for stage in stages)
+
+    def estimates(self):
+        with self._lock:
+            return {stage: round(value, 4) for stage, value in sorted(self._estimates.items())}
+
+
+predictor = LatencyPredictor()
+add_stage_listener(predictor.observe)
+
+
+def should_acknowledge(elapsed):
+    """True if the rest of this turn is expected to push it past ACK_THRESHOLD_SECONDS"""
+    if not ACK_ENABLED:
+        return False
+    remaining = predictor.predict(REMAINING_STAGES)
+    return remaining is not None and (elapsed or 0.0) + remaining >= ACK_THRESHOLD_SECONDS
+
+
+def split_message(text, limit=MAX_MESSAGE_CHARS):
+    """Cut text into pieces of at most `limit` chars, preferring whitespace"""
+    pieces = []
+    while len(text) > limit:
+        cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        pieces.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text.strip():
+        pieces.append(text)
+    return pieces
+
+
+class SentenceChunker:
+    """Buffers streamed text and releases it in sentence-aligned messages"""
+
+    def __init__(self, min_chars=MIN_CHUNK_CHARS, max_chars=MAX_MESSAGE_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add streamed text; returns the messages that are ready to send"""
+        self._buffer += text
+        ready = []
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                return ready
+            message, self._buffer = self._buffer[:cut[0]].strip(), self._buffer[cut[1]:]
+            if message:
+                ready.append(message)
+
+    def _next_cut(self):
+        # first sentence end past min_chars; failing that, once the buffer is
+        # over the limit, the last sentence end or space that keeps it in
+        last = None
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.start() > self.max_chars:
+                break
+            if match.start() >= self.min_chars:
+                return match.start(), match.end()
+            last = match
+        if len(self._buffer) <= self.max_chars:
+            return None
+        if last is not None:
+            return last.start(), last.end()
+        space = self._buffer.rfind(" ", 0, self.max_chars)
+        return (space, space + 1) if space > 0 else (self.max_chars, self.max_chars)
+
+    def flush(self):
+        rest, self._buffer = self._buffer, ""
+        return split_message(rest.strip(), self.max_chars)
+
+
+def stream_reply(pieces, send, chunker=None):
+    """
+    Send a streamed reply as it arrives.
+
+    Parameters:
+    pieces (iterable): Text deltas from the model.
+    send (callable): send(text) delivers one message and returns once it was accepted.
+    chunker (SentenceChunker): Optional chunker, e.g. with other limits.
+
+    Returns:
+    tuple: (full reply text, number of messages sent). Control replies
+    (TRUE,... / FALSE) are collected but never sent.
+    """
+    chunker = chunker or SentenceChunker()
+    parts = []
+    held = ""
+    is_control = None
+    sent = 0
+    for piece in pieces:
+        parts.append(piece)
+        if is_control is None:
+            held += piece
+            start = held.lstrip()
+            if len(start) < CONTROL_PREFIX_CHARS:
+                if not any(prefix.startswith(start) for prefix in CONTROL_PREFIXES):
+                    is_control = False
+                else:
+                    continue
+            else:
+                is_control = start.startswith(CONTROL_PREFIXES)
+            piece, held = held, ""
+        if is_control:
+            continue
+        for message in chunker.feed(piece):
+            send(message)
+            sent += 1
+    text = "".join(parts)
+    if is_control is None:
+        # the whole reply was shorter than a control keyword
+        is_control = text.strip().startswith(CONTROL_PREFIXES)
+    if not is_control:
+        for message in chunker.feed(held) + chunker.flush():
+            send(message)
+            sent += 1
+    return text, sent
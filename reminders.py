@@ -0,0 +1,317 @@
+"""
+Appointment reminder scheduler.
+
+Upcoming appointments are kept in a min-heap ordered by reminder time, loaded
+with a range scan over the (status, booking_time) index for the next
+`horizon` hours and updated incrementally whenever this process makes,
+cancels, moves or deletes a booking (see changed_by / sync). Bookings
+written by any other process (other cluster workers through the writer,
+bulk.py, admin tools) bump the appointments counter in table_versions; the
+scheduler checks it every REMINDER_RESCAN_SECONDS and reloads its window
+when it moved. A background thread sleeps until the earliest reminder is due,
+claims due appointments by stamping `appointments.reminded_at` (so a restart
+never sends the same reminder twice) and sends them in rate-limited batches
+through the app's outbound path.
+
+Environment:
+    REMINDERS_ENABLED           start the scheduler with the app (default off)
+    REMINDER_LEAD_MINUTES       how long before booking_time to remind (default 120)
+    REMINDER_HORIZON_HOURS      how far ahead the heap is loaded (default 24)
+    REMINDER_BATCH_SIZE         reminders claimed per batch (default 50)
+    REMINDER_RATE_PER_SECOND    outbound reminder rate limit (default 5)
+    REMINDER_RESCAN_SECONDS     how often to check for bookings changed elsewhere (default 5)
+"""
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import execute_query, current_versions
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+SYNC_CHUNK = 500
+
+# statements that can cancel, move or delete bookings; "where" is their row filter
+_APPOINTMENT_CHANGE = re.compile(
+    r"^\s*(?:update\s+appointments\s+set\b.*?|delete\s+from\s+appointments\b.*?)(?:\bwhere\s+(?P<where>.*))?$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def parse_booking_time(value):
+    """booking_time as stored ("YYYY-MM-DD HH:MM[:SS]", naive local time) -> datetime, or None"""
+    text = str(value).strip().replace("T", " ")
+    for fmt in (TIME_FORMAT, "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(text[:19], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def reminder_message(row):
+    return (
+        f"Reminder: your {row['product_name'] or 'appointment'} with {row['artist_name'] or 'your stylist'} "
+        f"is at {row['booking_time']}.\n\nPlease arrive 10 minutes early. See you soon!"
+    )
+
+
+class ReminderScheduler:
+    def __init__(self, lead_minutes=120, horizon_hours=24, batch_size=50, rate_per_second=5.0, rescan_seconds=5.0):
+        """
+        Parameters:
+        lead_minutes (int): How long before booking_time the reminder is sent.
+        horizon_hours (int): How far ahead appointments are loaded into the heap.
+        batch_size (int): Maximum reminders claimed and sent per batch.
+        rate_per_second (float): Outbound send rate limit.
+        rescan_seconds (float): How often the appointments write counter is checked.
+        """
+        self.lead = timedelta(minutes=lead_minutes)
+        self.horizon = timedelta(hours=horizon_hours)
+        self.batch_size = batch_size
+        self.rate_per_second = rate_per_second
+        self.rescan_seconds = rescan_seconds
+        self.send = None
+        self.sent = 0
+        self._heap = []
+        # appointment id -> reminder time of its live heap entry; heap entries
+        # that don't match are stale (rescheduled or cancelled) and skipped
+        self._live = {}
+        self._loaded_until = None
+        # appointments write counter the heap was loaded at
+        self._loaded_version = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    # -- heap maintenance --------------------------------------------------
+
+    def _push(self, appointment_id, booking_time):
+        when = parse_booking_time(booking_time)
+        if when is None:
+            logger.warning("Not scheduling reminder for appointment %s: bad booking_time %r", appointment_id, booking_time)
+            return False
+        remind_at = when - self.lead
+        self._live[appointment_id] = remind_at
+        heapq.heappush(self._heap, (remind_at, appointment_id))
+        return True
+
+    def _appointments_version(self):
+        try:
+            return current_versions().get("appointments", 0)
+        except Exception:
+            # no table_versions (a database from before the triggers): periodic loads only
+            return None
+
+    def appointments_changed(self):
+        """True when appointments were written (by any process) since the last load()"""
+        version = self._appointments_version()
+        return version is not None and version != self._loaded_version
+
+    def load(self, now=None, quiet=False):
+        """(Re)load unreminded bookings in [now, now + horizon] with one indexed range scan"""
+        now = now or datetime.now()
+        until = now + self.horizon
+        # read before the scan, so a write landing during it triggers another load
+        version = self._appointments_version()
+        rows = execute_query(
+            "SELECT id, booking_time FROM appointments "
+            "WHERE status = 'booked' AND booking_time >= ? AND booking_time < ? AND reminded_at IS NULL",
+            (now.strftime(TIME_FORMAT), until.strftime(TIME_FORMAT)),
+        )
+        with self._cond:
+            self._heap = []
+            self._live = {}
+            for row in rows:
+                self._push(row["id"], row["booking_time"])
+            self._loaded_until = until
+            self._loaded_version = version
+            self._cond.notify()
+        logger.log(logging.DEBUG if quiet else logging.INFO,
+                   "Loaded %s upcoming reminders until %s", len(rows), until.strftime(TIME_FORMAT))
+        return len(rows)
+
+    def schedule(self, appointment_id, booking_time):
+        """Add or move one appointment's reminder (called when a booking is made or changed)"""
+        when = parse_booking_time(booking_time)
+        if when is None or self._loaded_until is None or when >= self._loaded_until:
+            # outside the loaded window; the next load() picks it up
+            return False
+        with self._cond:
+            pushed = self._push(appointment_id, booking_time)
+            self._cond.notify()
+        return pushed
+
+    def cancel(self, appointment_id):
+        """Drop one appointment's reminder (called when a booking is cancelled)"""
+        with self._cond:
+            return self._live.pop(appointment_id, None) is not None
+
+    def changed_by(self, query):
+        """
+        Ids of the appointments an UPDATE or DELETE on appointments is about to
+        change, read with the statement's own filter before it runs (afterwards
+        a cancelled booking may no longer match it). None for other statements.
+        """
+        match = _APPOINTMENT_CHANGE.match(query)
+        if not match:
+            return None
+        where = match.group("where")
+        try:
+            rows = execute_query("SELECT id FROM appointments" + (f" WHERE {where}" if where else ""))
+            return [row["id"] for row in rows]
+        except Exception as e:
+            logger.warning("Could not read which appointments a statement changes (%s); re-checking every pending reminder", e)
+            with self._cond:
+                return list(self._live)
+
+    def sync(self, appointment_ids):
+        """
+        Bring reminders in line with appointments that were just changed: a
+        cancelled, completed or deleted booking loses its reminder and a moved
+        one is rescheduled for its new time.
+
+        Returns:
+        int: Number of reminders cancelled or moved.
+        """
+        appointment_ids = list(appointment_ids or ())
+        booked = {}
+        for start in range(0, len(appointment_ids), SYNC_CHUNK):
+            chunk = appointment_ids[start:start + SYNC_CHUNK]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = execute_query(
+                f"SELECT id, booking_time FROM appointments "
+                f"WHERE id IN ({placeholders}) AND status = 'booked' AND reminded_at IS NULL",
+                tuple(chunk),
+            )
+            booked.update((row["id"], row["booking_time"]) for row in rows)
+        changed = 0
+        for appointment_id in appointment_ids:
+            when = parse_booking_time(booked.get(appointment_id))
+            with self._cond:
+                current = self._live.get(appointment_id)
+            if when is not None and current == when - self.lead:
+                continue
+            dropped = self.cancel(appointment_id)
+            moved = when is not None and self.schedule(appointment_id, booked[appointment_id])
+            changed += bool(dropped or moved)
+        return changed
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            remind_at, appointment_id = heapq.heappop(self._heap)
+            if self._live.get(appointment_id) == remind_at:
+                del self._live[appointment_id]
+                due.append(appointment_id)
+        return due
+
+    # -- sending -------------------------------------------------------------
+
+    def _claim(self, appointment_ids):
+        """
+        Stamp reminded_at on still-booked, unreminded appointments and return
+        their details. The unique claim stamp identifies exactly the rows this
+        call won, so a reminder is sent at most once even across restarts.
+        """
+        claim = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        placeholders = ",".join("?" for _ in appointment_ids)
+        execute_query(
+            f"UPDATE appointments SET reminded_at = ? "
+            f"WHERE id IN ({placeholders}) AND status = 'booked' AND reminded_at IS NULL",
+            (claim, *appointment_ids),
+        )
+        return execute_query(
+            "SELECT a.id, a.booking_time, u.phone, u.name AS user_name, "
+            "ar.name AS artist_name, p.name AS product_name "
+            "FROM appointments a "
+            "JOIN users u ON u.id = a.user_id "
+            "LEFT JOIN artists ar ON ar.id = a.artist_id "
+            "LEFT JOIN products p ON p.id = a.product_id "
+            f"WHERE a.id IN ({placeholders}) AND a.reminded_at = ?",
+            (*appointment_ids, claim),
+        )
+
+    def send_batch(self, appointment_ids):
+        """Claim and send reminders for a batch, pacing sends to rate_per_second"""
+        rows = self._claim(appointment_ids)
+        interval = 1.0 / self.rate_per_second if self.rate_per_second else 0.0
+        for row in rows:
+            started = time.monotonic()
+            phone = row["phone"] if str(row["phone"]).startswith("whatsapp:") else f"whatsapp:{row['phone']}"
+            try:
+                self.send(reminder_message(row), phone)
+                self.sent += 1
+            except Exception as e:
+                logger.error("Failed to send reminder for appointment %s: %s", row["id"], e)
+            if self._stopping:
+                break
+            pause = interval - (time.monotonic() - started)
+            if pause > 0:
+                time.sleep(pause)
+        return len(rows)
+
+    def _run(self):
+        while not self._stopping:
+            now = datetime.now()
+            periodic = self._loaded_until is None or now >= self._loaded_until - self.horizon / 2
+            if periodic or self.appointments_changed():
+                try:
+                    self.load(now, quiet=not periodic)
+                except Exception as e:
+                    logger.error("Failed to load reminders: %s", e, exc_info=True)
+            with self._cond:
+                due = self._pop_due(datetime.now())
+                if not due:
+                    next_due = self._heap[0][0] if self._heap else None
+                    reload_at = self._loaded_until - self.horizon / 2 if self._loaded_until else now
+                    wake_at = min(next_due, reload_at) if next_due else reload_at
+                    timeout = min(60.0, self.rescan_seconds, (wake_at - datetime.now()).total_seconds())
+                    self._cond.wait(timeout=max(0.05, timeout))
+                    continue
+            try:
+                sent = self.send_batch(due)
+                logger.info("Sent %s of %s due reminders", sent, len(due))
+            except Exception as e:
+                logger.error("Failed to send reminder batch: %s", e, exc_info=True)
+
+    def start(self, send):
+        """
+        Start the background scheduler thread.
+
+        Parameters:
+        send (callable): send(body, to_number), e.g. app.twilio_send.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self.send = send
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    @property
+    def running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "false").lower() in ("1", "true", "yes")
+
+reminder_scheduler = ReminderScheduler(
+    lead_minutes=int(os.getenv("REMINDER_LEAD_MINUTES", "120")),
+    horizon_hours=int(os.getenv("REMINDER_HORIZON_HOURS", "24")),
+    batch_size=int(os.getenv("REMINDER_BATCH_SIZE", "50")),
+    rate_per_second=float(os.getenv("REMINDER_RATE_PER_SECOND", "5")),
+    rescan_seconds=float(os.getenv("REMINDER_RESCAN_SECONDS", "5")),
+)
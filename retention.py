@@ -0,0 +1,339 @@
+"""
+Message history retention and compressed archival.
+
+Ended chats older than N days are moved out of the hot database into
+append-only, gzip-compressed JSONL segments, one per month
+(archive/chats-YYYY-MM.jsonl.gz). Every chat is written as its own gzip
+member, so the (segment, offset, length) row kept in `chat_archive_index`
+is enough to decompress a single conversation without reading the rest of
+the segment, while a plain gzip reader still streams a whole segment.
+
+Chats are archived in small batches, each committed in its own transaction,
+and freed pages are returned with `PRAGMA incremental_vacuum` after every
+batch, so the job never holds the writer lock for long.
+
+A batch's members are appended to the segments before its transaction
+commits. The same transaction records each segment's new size in
+`archive_segments`, so bytes past the recorded size belong to a run that
+died in between: the next run truncates them before appending (the chats
+are still in the database and get archived again) and readers stop at the
+recorded size, so no chat is ever archived twice.
+
+Usage:
+    python retention.py archive --days 90
+    python retention.py show CHAT_ID
+    python retention.py dump --month 2026-01
+    python retention.py enable-incremental-vacuum
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+
+def _connect():
+    conn = sqlite3.connect(database.DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def segment_name(created_at):
+    """Segment file for a chat, by the month it was started in"""
+    month = (created_at or "")[:7] or time.strftime("%Y-%m")
+    return f"chats-{month}.jsonl.gz"
+
+
+def _append_member(path, record):
+    """Append one gzip member holding a JSON line; returns (offset, length)"""
+    payload = gzip.compress((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return offset, len(payload)
+
+
+def _truncate(path, size):
+    with open(path, "r+b") as f:
+        f.truncate(size)
+
+
+def _committed_size(conn, segment):
+    """
+    Bytes of a segment covered by committed index rows.
+
+    Segments written before archive_segments existed fall back to the end of
+    their last indexed member; a segment no batch ever committed to is 0, so
+    everything in it was left by a run that died before its first commit.
+    """
+    row = conn.execute("SELECT committed_size FROM archive_segments WHERE segment = ?", (segment,)).fetchone()
+    if row is None:
+        row = conn.execute(
+            "SELECT COALESCE(MAX(offset + length), 0) FROM chat_archive_index WHERE segment = ?", (segment,)
+        ).fetchone()
+    return row[0]
+
+
+def _open_segment(path, segment, committed_size):
+    """Open a segment for appending, first dropping any tail an interrupted run left; returns its size"""
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size > committed_size:
+        logger.warning(
+            "Dropping %s uncommitted bytes at the end of %s left by an interrupted run",
+            size - committed_size, segment,
+        )
+        _truncate(path, committed_size)
+        size = committed_size
+    return size
+
+
+class _Bounded:
+    """Read-only view of the first `limit` bytes of a file, for GzipFile"""
+
+    def __init__(self, f, limit):
+        self._f = f
+        self._left = limit
+
+    def read(self, size=-1):
+        size = self._left if size is None or size < 0 else min(size, self._left)
+        data = self._f.read(size)
+        self._left -= len(data)
+        return data
+
+
+def archive_ended_chats(days=90, archive_dir=ARCHIVE_DIR, batch_size=200, vacuum_pages=500, max_batches=None):
+    """
+    Move ended chats whose last update is older than `days` into the archive.
+
+    Parameters:
+    days (int): Minimum age, in days since chats.updated_at, of an ended chat.
+    archive_dir (str): Directory holding the monthly segments.
+    batch_size (int): Chats archived per transaction.
+    vacuum_pages (int): Pages handed to `PRAGMA incremental_vacuum` after each batch.
+    max_batches (int): Stop after this many batches (None for no limit).
+
+    Returns:
+    dict: Counts of archived chats and messages and the number of batches run.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = _connect()
+    totals = {"chats": 0, "messages": 0, "batches": 0}
+    last_id = 0
+    try:
+        while max_batches is None or totals["batches"] < max_batches:
+            chats = conn.execute(
+                """
+                SELECT id, user_id, status, created_at, updated_at FROM chats
+                WHERE status = 'ended' AND updated_at < datetime('now', ?) AND id > ?
+                ORDER BY id LIMIT ?
+                """,
+                (f"-{int(days)} days", last_id, batch_size),
+            ).fetchall()
+            if not chats:
+                break
+            last_id = chats[-1]["id"]
+
+            # remember segment sizes so a failed commit can roll the files back too
+            written = {}
+            index_rows = []
+            message_count = 0
+            try:
+                for chat in chats:
+                    messages = [
+                        dict(row) for row in conn.execute(
+                            "SELECT id, user_id, user_message, bot_reply, created_at FROM messages "
+                            "WHERE chat_id = ? ORDER BY id",
+                            (chat["id"],),
+                        )
+                    ]
+                    segment = segment_name(chat["created_at"])
+                    path = os.path.join(archive_dir, segment)
+                    if path not in written:
+                        written[path] = _open_segment(path, segment, _committed_size(conn, segment))
+                    record = {"chat": dict(chat), "messages": messages}
+                    offset, length = _append_member(path, record)
+                    index_rows.append((chat["id"], chat["user_id"], segment, offset, length, len(messages)))
+                    message_count += len(messages)
+
+                chat_ids = [(row[0],) for row in index_rows]
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO chat_archive_index "
+                        "(chat_id, user_id, segment, offset, length, message_count) VALUES (?, ?, ?, ?, ?, ?)",
+                        index_rows,
+                    )
+                    conn.executemany("DELETE FROM messages WHERE chat_id = ?", chat_ids)
+                    conn.executemany("DELETE FROM chats WHERE id = ?", chat_ids)
+                    # the commit point for the appended bytes as well
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO archive_segments (segment, committed_size) VALUES (?, ?)",
+                        [(os.path.basename(path), os.path.getsize(path)) for path in written],
+                    )
+            except Exception:
+                for path, size in written.items():
+                    _truncate(path, size)
+                raise
+
+            if vacuum_pages:
+                conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+            totals["chats"] += len(index_rows)
+            totals["messages"] += message_count
+            totals["batches"] += 1
+            logger.info("Archived %s chats (%s messages) up to chat %s", len(index_rows), message_count, last_id)
+    finally:
+        conn.close()
+    return totals
+
+
+def read_archived_chat(chat_id, archive_dir=ARCHIVE_DIR):
+    """
+    Fetch one archived conversation through the offset index.
+
+    Returns:
+    dict: {"chat": {...}, "messages": [...]} or None when the chat isn't archived.
+    """
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT segment, offset, length FROM chat_archive_index WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    with open(os.path.join(archive_dir, row["segment"]), "rb") as f:
+        f.seek(row["offset"])
+        payload = f.read(row["length"])
+    return json.loads(gzip.decompress(payload).decode("utf-8"))
+
+
+def archived_chats_for_user(user_id):
+    """Index rows (chat_id, segment, message_count, archived_at) for one user's archived chats"""
+    conn = _connect()
+    try:
+        return [
+            dict(row) for row in conn.execute(
+                "SELECT chat_id, segment, message_count, archived_at FROM chat_archive_index "
+                "WHERE user_id = ? ORDER BY chat_id",
+                (user_id,),
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def iter_archive(month=None, archive_dir=ARCHIVE_DIR):
+    """
+    Stream archived conversations one at a time, stopping at each segment's
+    committed size.
+
+    Parameters:
+    month (str): "YYYY-MM" to read a single segment, or None for all segments in order.
+
+    Yields:
+    dict: {"chat": {...}, "messages": [...]}
+    """
+    if month:
+        segments = [segment_name(month)]
+    else:
+        segments = sorted(
+            name for name in os.listdir(archive_dir)
+            if name.startswith("chats-") and name.endswith(".jsonl.gz")
+        ) if os.path.isdir(archive_dir) else []
+    conn = _connect()
+    try:
+        committed = {}
+        for segment in segments:
+            try:
+                committed[segment] = _committed_size(conn, segment)
+            except sqlite3.OperationalError:
+                # not an archive database; read the segments as they are
+                committed[segment] = None
+    finally:
+        conn.close()
+    for segment in segments:
+        path = os.path.join(archive_dir, segment)
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as raw:
+            source = raw if committed[segment] is None else _Bounded(raw, committed[segment])
+            with io.TextIOWrapper(gzip.GzipFile(fileobj=source, mode="rb"), encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=INCREMENTAL (runs a full VACUUM once)"""
+    conn = _connect()
+    try:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive and read old chat history")
+    parser.add_argument("--db", help="Database file (defaults to database.DB_FILE)")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="Archive directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive = commands.add_parser("archive", help="Move old ended chats into the archive")
+    archive.add_argument("--days", type=int, default=90)
+    archive.add_argument("--batch-size", type=int, default=200)
+    archive.add_argument("--vacuum-pages", type=int, default=500)
+    archive.add_argument("--max-batches", type=int)
+
+    show = commands.add_parser("show", help="Print one archived chat")
+    show.add_argument("chat_id", type=int)
+
+    dump = commands.add_parser("dump", help="Stream archived chats as JSONL")
+    dump.add_argument("--month", help="YYYY-MM segment to read (default: all)")
+
+    commands.add_parser("enable-incremental-vacuum", help="Convert an existing database to incremental vacuum")
+
+    args = parser.parse_args(argv)
+    if args.db:
+        database.DB_FILE = args.db
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "archive":
+        database.init_db()
+        start = time.perf_counter()
+        totals = archive_ended_chats(args.days, args.dir, args.batch_size, args.vacuum_pages, args.max_batches)
+        totals["seconds"] = round(time.perf_counter() - start, 3)
+        print(json.dumps(totals))
+    elif args.command == "show":
+        record = read_archived_chat(args.chat_id, args.dir)
+        if record is None:
+            print(f"Chat {args.chat_id} is not archived", file=sys.stderr)
+            return 1
+        print(json.dumps(record, indent=2, ensure_ascii=False))
+    elif args.command == "dump":
+        for record in iter_archive(args.month, args.dir):
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    elif args.command == "enable-incremental-vacuum":
+        changed = enable_incremental_vacuum()
+        print("auto_vacuum set to INCREMENTAL" if changed else "auto_vacuum already INCREMENTAL")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
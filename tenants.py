@@ -0,0 +1,278 @@
+"""
+Multi-tenant mode: one process serving many spas.
+
+A tenant registry (JSON file named by TENANTS_FILE) maps the inbound `To`
+WhatsApp number to a tenant: its database file, optional catalog, Twilio
+credentials and prompt persona. Open tenants (a small connection pool plus
+lazily built Twilio client and validator) live in an LRU; tenants idle for
+TENANT_IDLE_SECONDS or pushed out by TENANT_MAX_OPEN are closed, so hundreds
+of low-traffic spas share one process.
+
+Registry format:
+    [
+      {
+        "name": "downtown",
+        "whatsapp_number": "whatsapp:+14155238886",
+        "db_file": "tenants/downtown.db",
+        "twilio_account_sid": "AC...",
+        "twilio_auth_token": "...",
+        "persona": "You are Bella, the assistant for Downtown Spa.",
+        "catalog": {"products": [{"name": "Haircut", "price": 30, "duration": 30}],
+                    "artists": [{"name": "John", "experience": 5, "expertise": "Hair Styling"}]}
+      }
+    ]
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import database
+
+logger = logging.getLogger(__name__)
+
+_current_tenant = ContextVar("current_tenant", default=None)
+
+
+def normalize_number(number):
+    """"whatsapp:+1 415-523-8886" -> "+14155238886\""""
+    number = (number or "").strip()
+    if number.startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    return "".join(ch for ch in number if ch.isdigit() or ch == "+")
+
+
+def current_tenant():
+    """The Tenant handling the current request, or None in single-tenant mode"""
+    return _current_tenant.get()
+
+
+class TenantConfig:
+    def __init__(self, name, whatsapp_number, db_file, twilio_account_sid=None,
+                 twilio_auth_token=None, persona=None, catalog=None):
+        self.name = name
+        self.whatsapp_number = whatsapp_number if whatsapp_number.startswith("whatsapp:") else f"whatsapp:{whatsapp_number}"
+        self.db_file = db_file
+        self.twilio_account_sid = twilio_account_sid
+        self.twilio_auth_token = twilio_auth_token
+        self.persona = persona
+        self.catalog = catalog
+        self._validator = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=data["name"],
+            whatsapp_number=data["whatsapp_number"],
+            db_file=data["db_file"],
+            twilio_account_sid=data.get("twilio_account_sid"),
+            twilio_auth_token=data.get("twilio_auth_token"),
+            persona=data.get("persona"),
+            catalog=data.get("catalog"),
+        )
+
+    def validator(self):
+        # kept on the config rather than the open Tenant so signatures can be
+        # checked without opening the tenant's database
+        if self._validator is None:
+            from twilio.request_validator import RequestValidator
+            self._validator = RequestValidator(self.twilio_auth_token)
+        return self._validator
+
+
+class Tenant:
+    """An open tenant: its connection pool and Twilio clients"""
+
+    def __init__(self, config, pool_size=2, cache_kib=512):
+        self.config = config
+        self.pool = database.ConnectionPool(config.db_file, size=pool_size, cache_kib=cache_kib)
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self._twilio_client = None
+
+    def twilio_client(self):
+        if self._twilio_client is None:
+            from twilio.rest import Client
+            self._twilio_client = Client(self.config.twilio_account_sid, self.config.twilio_auth_token)
+        return self._twilio_client
+
+    def validator(self):
+        return self.config.validator()
+
+    def close(self):
+        self.pool.close()
+
+
+def prepare_tenant_db(config):
+    """
+    Create a tenant's database on first use. Only the schema is created (none
+    of the sample data init_db puts in the default database); the catalog is
+    seeded from the registry if it has one, otherwise load it with bulk.py.
+    """
+    is_new = not os.path.exists(config.db_file)
+    directory = os.path.dirname(config.db_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    database.init_db(config.db_file, seed=False)
+    if is_new and config.catalog:
+        conn = sqlite3.connect(config.db_file)
+        with conn:
+            conn.executemany(
+                "INSERT INTO products (name, price, duration) VALUES (?, ?, ?)",
+                [(p["name"], p["price"], p["duration"]) for p in config.catalog.get("products", [])],
+            )
+            conn.executemany(
+                "INSERT INTO artists (name, experience, expertise) VALUES (?, ?, ?)",
+                [(a["name"], a["experience"], a["expertise"]) for a in config.catalog.get("artists", [])],
+            )
+        conn.close()
+
+
+class TenantManager:
+    def __init__(self, configs=(), max_open=64, idle_seconds=600, pool_size=2, cache_kib=512):
+        """
+        Parameters:
+        configs (iterable): TenantConfig entries.
+        max_open (int): Most tenants kept open at once.
+        idle_seconds (float): Tenants unused for this long are closed.
+        pool_size (int): Idle connections kept per open tenant.
+        cache_kib (int): SQLite page cache per connection.
+        """
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.pool_size = pool_size
+        self.cache_kib = cache_kib
+        self._configs = {}
+        self._open = OrderedDict()
+        self._prepared = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for config in configs:
+            self.register(config)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls([TenantConfig.from_dict(item) for item in json.load(f)], **kwargs)
+
+    @property
+    def enabled(self):
+        return bool(self._configs)
+
+    def register(self, config):
+        self._configs[normalize_number(config.whatsapp_number)] = config
+
+    def config_for(self, to_number):
+        """Registry entry for an inbound number, without opening the tenant; None when unknown"""
+        return self._configs.get(normalize_number(to_number))
+
+    def get(self, to_number):
+        """
+        Open (or reuse) the tenant owning this inbound number; None when unknown.
+
+        The tenant comes back pinned, so it can't be evicted before the caller
+        uses it: pass it to activate(), which releases the pin on exit, or
+        call release() when it won't be activated.
+        """
+        key = normalize_number(to_number)
+        config = self._configs.get(key)
+        if config is None:
+            return None
+        with self._lock:
+            tenant = self._open.get(key)
+            if tenant is not None:
+                self._open.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                if key not in self._prepared:
+                    prepare_tenant_db(config)
+                    self._prepared.add(key)
+                tenant = Tenant(config, self.pool_size, self.cache_kib)
+                self._open[key] = tenant
+            tenant.last_used = time.monotonic()
+            tenant.in_use += 1
+            self._evict_locked()
+        return tenant
+
+    def release(self, tenant):
+        """Drop the pin taken by get() for a tenant that won't be activated"""
+        if tenant is None:
+            return
+        with self._lock:
+            tenant.in_use -= 1
+            tenant.last_used = time.monotonic()
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        # oldest first; tenants still serving a request are skipped
+        for key in list(self._open):
+            tenant = self._open[key]
+            over_capacity = len(self._open) > self.max_open
+            idle = now - tenant.last_used > self.idle_seconds
+            if not (over_capacity or idle):
+                break
+            if tenant.in_use:
+                continue
+            del self._open[key]
+            tenant.close()
+            self.evictions += 1
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_locked()
+
+    @contextmanager
+    def activate(self, tenant):
+        """
+        Route execute_query and outbound sends to `tenant` for the enclosed
+        block (no-op for None). Takes over the pin from get() and drops it on exit.
+        """
+        if tenant is None:
+            yield None
+            return
+        token = _current_tenant.set(tenant)
+        try:
+            with database.use_pool(tenant.pool):
+                yield tenant
+        finally:
+            _current_tenant.reset(token)
+            self.release(tenant)
+
+    def stats(self):
+        return {
+            "tenants": len(self._configs),
+            "open": len(self._open),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            for tenant in self._open.values():
+                tenant.close()
+            self._open.clear()
+
+
+def load_tenant_manager():
+    path = os.getenv("TENANTS_FILE")
+    kwargs = {
+        "max_open": int(os.getenv("TENANT_MAX_OPEN", "64")),
+        "idle_seconds": float(os.getenv("TENANT_IDLE_SECONDS", "600")),
+    }
+    if path:
+        manager = TenantManager.from_file(path, **kwargs)
+        logger.info("Loaded %s tenants from %s", manager.stats()["tenants"], path)
+        return manager
+    return TenantManager(**kwargs)
+
+
+tenant_manager = load_tenant_manager()
@@ -0,0 +1,328 @@
+"""
+Lightweight tracing and Prometheus-style metrics.
+
+Spans time a named pipeline stage and feed a histogram. Agent calls and
+database statements get their own histograms, and every inbound message
+records how many LLM calls it took. `render_metrics()` returns the Prometheus
+text exposition format served at /metrics.
+"""
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels):
+        """Return (count, sum) for one label set"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+stage_seconds = register(Histogram(
+    "beaubot_stage_seconds", "Time spent in each webhook pipeline stage.", ["stage"]
+))
+agent_call_seconds = register(Histogram(
+    "beaubot_agent_call_seconds", "Time spent in Agent.run calls.", ["agent", "method"]
+))
+db_query_seconds = register(Histogram(
+    "beaubot_db_query_seconds", "Time spent executing SQL statements.", ["statement"]
+))
+llm_calls_total = register(Counter(
+    "beaubot_llm_calls_total", "LLM calls made, by agent and method.", ["agent", "method"]
+))
+llm_calls_per_message = register(Histogram(
+    "beaubot_llm_calls_per_message", "LLM calls made while handling one inbound message.",
+    buckets=(1, 2, 4, 6, 8, 10, 12, 15, 20, 30)
+))
+messages_total = register(Counter(
+    "beaubot_inbound_messages_total", "Inbound WhatsApp messages handled."
+))
+query_cache_total = register(Counter(
+    "beaubot_query_cache_total", "SELECT result cache lookups, by table read and result (hit, miss, stale).",
+    ["table", "result"]
+))
+model_tier_calls_total = register(Counter(
+    "beaubot_model_tier_calls_total", "Booking agent calls per model tier, by outcome (ok, error, fallback).",
+    ["tier", "outcome"]
+))
+model_tier_seconds = register(Histogram(
+    "beaubot_model_tier_seconds", "Booking agent call latency per model tier.", ["tier"]
+))
+model_tier_cost_total = register(Counter(
+    "beaubot_model_tier_cost_usd_total", "Estimated model spend per tier, in USD.", ["tier"]
+))
+time_to_first_message_seconds = register(Histogram(
+    "beaubot_time_to_first_message_seconds", "From an inbound message to the first outbound reply."
+))
+time_to_complete_seconds = register(Histogram(
+    "beaubot_time_to_complete_seconds", "From an inbound message to its last outbound reply."
+))
+webhook_rejections_total = register(Counter(
+    "beaubot_webhook_rejections_total", "Webhook requests refused before any processing, by reason.", ["reason"]
+))
+
+_llm_calls = ContextVar("llm_calls", default=None)
+_token_usage = ContextVar("token_usage", default=None)
+# [start, first reply sent, last reply sent] of the message being handled
+_message_clock = ContextVar("message_clock", default=None)
+
+_stage_listeners = []
+
+
+def add_stage_listener(listener):
+    """Call `listener(stage, seconds)` for every finished span"""
+    _stage_listeners.append(listener)
+
+
+class SpanClock:
+    """Yielded by span(); time spent inside paused() is left out of the stage"""
+
+    __slots__ = ("excluded",)
+
+    def __init__(self):
+        self.excluded = 0.0
+
+    @contextmanager
+    def paused(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.excluded += time.perf_counter() - start
+
+
+@contextmanager
+def span(stage):
+    """Time a pipeline stage into beaubot_stage_seconds"""
+    clock = SpanClock()
+    start = time.perf_counter()
+    try:
+        yield clock
+    finally:
+        elapsed = time.perf_counter() - start - clock.excluded
+        stage_seconds.observe(elapsed, stage=stage)
+        for listener in _stage_listeners:
+            listener(stage, elapsed)
+
+
+@contextmanager
+def message_trace():
+    """
+    Scope one inbound message: counts the LLM calls made inside it, times
+    the whole request as the "webhook" stage, and records how long the user
+    waited for the first and the last outbound reply (see mark_reply_sent).
+    """
+    calls = [0]
+    clock = [time.perf_counter(), None, None]
+    token = _llm_calls.set(calls)
+    clock_token = _message_clock.set(clock)
+    messages_total.inc()
+    try:
+        with span("webhook"):
+            yield
+    finally:
+        _llm_calls.reset(token)
+        _message_clock.reset(clock_token)
+        llm_calls_per_message.observe(calls[0])
+        if clock[1] is not None:
+            time_to_first_message_seconds.observe(clock[1] - clock[0])
+            time_to_complete_seconds.observe(clock[2] - clock[0])
+
+
+def mark_reply_sent():
+    """Note that a reply to the current message has just gone out"""
+    clock = _message_clock.get()
+    if clock is not None:
+        now = time.perf_counter()
+        if clock[1] is None:
+            clock[1] = now
+        clock[2] = now
+
+
+def message_elapsed():
+    """Seconds since the current message arrived, or None outside message_trace"""
+    clock = _message_clock.get()
+    return time.perf_counter() - clock[0] if clock is not None else None
+
+
+def traced_agent_call(func):
+    """
+    Decorator for agent methods that wrap a single Agent.run call. Generators
+    are timed while they run, not while suspended at a yield, so whatever the
+    consumer does with each piece (sending it) is not counted.
+    """
+    method = func.__name__
+
+    def start_call(self):
+        agent = type(self).__name__
+        llm_calls_total.inc(agent=agent, method=method)
+        calls = _llm_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        return agent, time.perf_counter()
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(self, *args, **kwargs):
+            agent, _ = start_call(self)
+            busy = 0.0
+            pieces = func(self, *args, **kwargs)
+            try:
+                while True:
+                    resumed = time.perf_counter()
+                    try:
+                        piece = next(pieces)
+                    except StopIteration:
+                        return
+                    finally:
+                        busy += time.perf_counter() - resumed
+                    yield piece
+            finally:
+                pieces.close()
+                agent_call_seconds.observe(busy, agent=agent, method=method)
+
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        agent, start = start_call(self)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            agent_call_seconds.observe(time.perf_counter() - start, agent=agent, method=method)
+
+    return wrapper
+
+
+@contextmanager
+def token_usage():
+    """Collect the [input, output] token counts that agent calls report with record_tokens()"""
+    usage = [0, 0]
+    token = _token_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _token_usage.reset(token)
+
+
+def record_tokens(input_tokens, output_tokens):
+    usage = _token_usage.get()
+    if usage is not None:
+        usage[0] += input_tokens
+        usage[1] += output_tokens
+
+
+@contextmanager
+def db_span(query):
+    """Time one SQL statement, labelled by its leading keyword"""
+    statement = query.lstrip().split(None, 1)[0].upper() if query.strip() else "EMPTY"
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        db_query_seconds.observe(time.perf_counter() - start, statement=statement)
+
+
+def render_metrics():
+    """Render every registered metric in Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
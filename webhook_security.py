@@ -0,0 +1,102 @@
+"""
+Cheap early rejection for the WhatsApp webhook.
+
+Every inbound POST is checked before any agent, database or Twilio work:
+oversized bodies and requests without an X-Twilio-Signature header are
+refused from the headers alone, a signature already accepted recently is
+refused as a replay (Twilio signs the MessageSid, so a genuine new message
+never repeats one), and only then is the form parsed and the HMAC checked.
+A forged flood therefore costs one header lookup, or one form parse and one
+HMAC, per request.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from tracing import webhook_rejections_total
+
+VALIDATE_SIGNATURES = os.getenv("TWILIO_VALIDATE_SIGNATURES", "true").lower() in ("1", "true", "yes")
+WEBHOOK_PUBLIC_URL = os.getenv("WEBHOOK_PUBLIC_URL")
+MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", "65536"))
+
+SIGNATURE_HEADER = "X-Twilio-Signature"
+
+
+class ReplayCache:
+    """Bounded set of recently accepted signatures, oldest dropped first"""
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600):
+        """
+        Parameters:
+        max_entries (int): Most signatures remembered at once.
+        ttl_seconds (float): How long a signature is remembered.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, signature):
+        now = time.monotonic()
+        with self._lock:
+            accepted_at = self._seen.get(signature)
+            return accepted_at is not None and now - accepted_at <= self.ttl_seconds
+
+    def add(self, signature):
+        """Remember an accepted signature; False if it was already there (a concurrent replay)"""
+        now = time.monotonic()
+        with self._lock:
+            accepted_at = self._seen.get(signature)
+            if accepted_at is not None and now - accepted_at <= self.ttl_seconds:
+                return False
+            self._seen[signature] = now
+            self._seen.move_to_end(signature)
+            while self._seen:
+                oldest, accepted_at = next(iter(self._seen.items()))
+                if len(self._seen) <= self.max_entries and now - accepted_at <= self.ttl_seconds:
+                    break
+                del self._seen[oldest]
+        return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+def reject(reason):
+    webhook_rejections_total.inc(reason=reason)
+
+
+def public_url(request):
+    """The URL Twilio signed: WEBHOOK_PUBLIC_URL when set (e.g. behind a TLS proxy), else the request URL"""
+    if WEBHOOK_PUBLIC_URL:
+        query = request.url.query
+        return WEBHOOK_PUBLIC_URL + (f"?{query}" if query else "")
+    return str(request.url)
+
+
+def precheck(request, replay_cache):
+    """
+    Header-only checks, run before the body is read.
+
+    Returns:
+    str: The signature, or None if the request was rejected (and counted).
+    """
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > MAX_BODY_BYTES:
+        reject("body_too_large")
+        return None
+    signature = request.headers.get(SIGNATURE_HEADER)
+    if not signature:
+        reject("missing_signature")
+        return None
+    if replay_cache.seen(signature):
+        reject("replay")
+        return None
+    return signature
+
+
+replay_cache = ReplayCache(
+    max_entries=int(os.getenv("WEBHOOK_REPLAY_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("WEBHOOK_REPLAY_TTL_SECONDS", "3600")),
+)